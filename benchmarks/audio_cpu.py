@@ -0,0 +1,124 @@
+"""
+CPU per concurrent stream of the playback paths, with 20 guilds playing at once.
+
+Every guild gets its own player thread reading its source as fast as it can. For the PCM paths,
+it also encodes each frame to Opus like the voice client does. The CPU time of the bot process and of
+the FFmpeg processes it spawned is divided by the seconds of audio played, giving the share of a core
+one stream needs in real time.
+
+    before   FFmpegPCMAudio + PCMVolumeTransformer + Opus encoder, as every song played before
+    gain     FFmpegPCMAudio + GainTransformer at 50% + Opus encoder, the path once the volume changed
+    opus     FFmpegOpusAudio copying the Opus packets, the path at 100% volume
+
+PCMVolumeTransformer scales the samples one by one in Python in the discord versions without audioop,
+so `before` costs that loop on every frame even at 100% volume.
+
+The input is a generated Opus/WebM file, which is what YouTube's bestaudio usually is.
+
+    python benchmarks/audio_cpu.py [--guilds 20] [--seconds 30] [--ffmpeg PATH] [--opus LIBOPUS]
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import (
+    Callable,
+    Optional,
+)
+
+import discord
+from discord import (
+    AudioSource,
+    PCMVolumeTransformer,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cores.musicbot.sources import (  # noqa: E402
+    FRAME_SECONDS,
+    GainTransformer,
+    ffmpeg_source,
+)
+
+FRAME_BYTES = 3840  # 20ms of 48kHz 16-bit stereo
+
+
+def _cpu_seconds(who: int) -> float:
+    usage = resource.getrusage(who)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _play(source: AudioSource, encode: bool, frames: list):
+    encoder = discord.opus.Encoder() if encode else None
+    played = 0
+    while frame := source.read():
+        if encoder is not None and len(frame) == FRAME_BYTES:
+            encoder.encode(frame, encoder.SAMPLES_PER_FRAME)
+        played += 1
+    source.cleanup()
+    frames.append(played)
+
+
+def run(name: str, open_source: Callable[[], AudioSource], encode: bool, guilds: int):
+    frames: list = []
+    sources = [open_source() for _ in range(guilds)]
+    started = time.perf_counter()
+    process_cpu = _cpu_seconds(resource.RUSAGE_SELF)
+    ffmpeg_cpu = _cpu_seconds(resource.RUSAGE_CHILDREN)
+
+    threads = [threading.Thread(target=_play, args=(source, encode, frames)) for source in sources]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.perf_counter() - started
+    process_cpu = _cpu_seconds(resource.RUSAGE_SELF) - process_cpu
+    ffmpeg_cpu = _cpu_seconds(resource.RUSAGE_CHILDREN) - ffmpeg_cpu
+    audio_seconds = sum(frames) * FRAME_SECONDS
+    per_stream = (process_cpu + ffmpeg_cpu) / audio_seconds * 100
+    print(f"  {name:<7} bot {process_cpu:6.2f}s  ffmpeg {ffmpeg_cpu:6.2f}s  wall {elapsed:6.2f}s  "
+          f"-> {per_stream:5.2f}% of a core per stream, {guilds * per_stream:6.1f}% for {guilds} guilds")
+
+
+def _use_ffmpeg(path: str, directory: str):
+    """ffmpeg_source runs `ffmpeg` from the PATH"""
+    link = os.path.join(directory, 'ffmpeg')
+    os.symlink(os.path.abspath(path), link)
+    os.environ['PATH'] = directory + os.pathsep + os.environ.get('PATH', '')
+
+
+def main(guilds: int, seconds: int, ffmpeg: Optional[str], opus: Optional[str]):
+    if opus is not None:
+        discord.opus.load_opus(opus)
+    encode = discord.opus.is_loaded() or discord.opus._load_default()
+    if not encode:
+        print("libopus not found, the PCM paths are measured without encoding (pass --opus)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        if ffmpeg is not None:
+            _use_ffmpeg(ffmpeg, directory)
+        track = os.path.join(directory, 'track.webm')
+        subprocess.run([
+            'ffmpeg', '-v', 'error', '-f', 'lavfi', '-i', f'anoisesrc=d={seconds}:c=pink:r=48000:a=0.3',
+            '-ac', '2', '-c:a', 'libopus', '-b:a', '128k', track
+        ], check=True)
+
+        print(f"{guilds} guilds playing {seconds}s of Opus/WebM each:")
+        run('before', lambda: PCMVolumeTransformer(ffmpeg_source(track), 1.0), encode, guilds)
+        run('gain', lambda: GainTransformer(ffmpeg_source(track), 0.5), encode, guilds)
+        run('opus', lambda: ffmpeg_source(track, passthrough=True), False, guilds)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--seconds', type=int, default=30)
+    parser.add_argument('--ffmpeg', help="ffmpeg executable if it isn't on the PATH")
+    parser.add_argument('--opus', help="libopus shared library if discord doesn't find it")
+    args = parser.parse_args()
+    main(args.guilds, args.seconds, args.ffmpeg, args.opus)
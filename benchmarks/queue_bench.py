@@ -0,0 +1,92 @@
+"""
+Compares the playlist operations on the old deque against IndexedQueue and IndexedHistory.
+
+    python benchmarks/queue_bench.py [size ...]
+"""
+import os
+import random
+import sys
+import time
+from collections import deque
+from typing import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cores.musicbot.indexedQueue import (  # noqa: E402
+    IndexedHistory,
+    IndexedQueue,
+)
+
+PAGE_SIZE = 15
+REPEAT = 200
+
+
+def _per_call(fn: Callable[[int], None], repeat: int = REPEAT) -> float:
+    """Mean microseconds of fn(i) over `repeat` calls"""
+    started = time.perf_counter()
+    for i in range(repeat):
+        fn(i)
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def bench(size: int):
+    items = [object() for _ in range(size)]
+    old = deque(items)
+    new = IndexedQueue(items)
+    middle = size // 2
+    rng = random.Random(0)
+    positions = [rng.randrange(size) for _ in range(REPEAT)]
+
+    def deque_move(i: int):
+        # Playlist.move before the indexed queue
+        item = old[positions[i]]
+        del old[positions[i]]
+        old.insert(middle, item)
+
+    def queue_move(i: int):
+        item = new[positions[i]]
+        del new[positions[i]]
+        new.insert(middle, item)
+
+    def deque_remove_insert(i: int):
+        item = old[positions[i]]
+        del old[positions[i]]
+        old.insert(positions[-i], item)
+
+    def queue_remove_insert(i: int):
+        item = new[positions[i]]
+        del new[positions[i]]
+        new.insert(positions[-i], item)
+
+    def deque_page(i: int):
+        # _queue and play_song copied the whole queue to read a page
+        list(old)[middle:middle + PAGE_SIZE]
+
+    def queue_page(i: int):
+        new.page(middle, middle + PAGE_SIZE)
+
+    old_history = deque(items)
+    new_history = IndexedHistory()
+    for item in items:
+        new_history.append(item)
+
+    def deque_history_index(i: int):
+        old_history.index(items[positions[i]])
+
+    def history_index(i: int):
+        new_history.index(items[positions[i]])
+
+    print(f"{size} entries, microseconds per operation:")
+    for name, before, after in (
+            ("move", deque_move, queue_move),
+            ("remove + insert at", deque_remove_insert, queue_remove_insert),
+            (f"page of {PAGE_SIZE}", deque_page, queue_page),
+            ("history index", deque_history_index, history_index),
+    ):
+        before_us, after_us = _per_call(before), _per_call(after)
+        print(f"  {name:<20} deque {before_us:>10.2f}  indexed {after_us:>8.2f}  ({before_us / after_us:.1f}x)")
+
+
+if __name__ == '__main__':
+    for queue_size in [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000]:
+        bench(queue_size)
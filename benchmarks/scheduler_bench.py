@@ -0,0 +1,81 @@
+"""
+Adds, cancels and fires 100k reminders on the heap-based Scheduler and checks that memory stays flat.
+
+    python benchmarks/scheduler_bench.py [count] [rounds]
+"""
+import asyncio
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cores.ScheduleHandler import Scheduler  # noqa: E402
+
+
+async def _noop(_):
+    pass
+
+
+def _traced_kib() -> int:
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] // 1024
+
+
+async def bench(count: int, rounds: int):
+    scheduler = Scheduler(_noop)
+    later = time.time() + 3600
+
+    started = time.perf_counter()
+    for i in range(count):
+        scheduler.add(str(i), later + i, i)
+    added = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for i in range(count):
+        scheduler.cancel(str(i))
+    cancelled = time.perf_counter() - started
+    print(f"{count} adds {added:.3f}s ({added / count * 1e6:.2f}us each), "
+          f"{count} cancels {cancelled:.3f}s ({cancelled / count * 1e6:.2f}us each)")
+
+    # memory after each round of adding and cancelling everything, it must not grow
+    tracemalloc.start()
+    baseline = _traced_kib()
+    for r in range(rounds):
+        for i in range(count):
+            scheduler.add(str(i), later + i, i)
+        peak = _traced_kib()
+        for i in range(count):
+            scheduler.cancel(str(i))
+        print(f"round {r}: {peak - baseline} KiB with {count} scheduled, "
+              f"{_traced_kib() - baseline} KiB after cancelling, heap {len(scheduler._heap)}")
+    tracemalloc.stop()
+    scheduler.close()
+
+    # every reminder due at once, the time until the dispatcher handed all of them to the callback
+    fired = 0
+    done = asyncio.Event()
+
+    async def count_firing(_):
+        nonlocal fired
+        fired += 1
+        if fired == count:
+            done.set()
+
+    scheduler = Scheduler(count_firing)
+    now = time.time()
+    for i in range(count):
+        scheduler.add(str(i), now, i)
+    started = time.perf_counter()
+    await done.wait()
+    print(f"{count} due reminders fired in {time.perf_counter() - started:.3f}s, {len(scheduler)} left")
+    scheduler.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(bench(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 100_000,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    ))
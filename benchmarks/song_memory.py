@@ -0,0 +1,107 @@
+"""
+Measures the memory of 100k queued tracks with the old dict-based Song against the slotted one,
+and the size and speed of pack_songs against pickling the old objects.
+
+    python benchmarks/song_memory.py [count]
+"""
+import gc
+import os
+import pickle
+import sys
+import time
+import tracemalloc
+from typing import (
+    Callable,
+    List,
+    Tuple,
+)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cores.musicbot import linkutils  # noqa: E402
+from cores.musicbot.songInfo import (  # noqa: E402
+    Song,
+    pack_songs,
+    unpack_songs,
+)
+
+UPLOADERS = 500
+
+
+class LegacySong(object):
+    """Song as it was before the slotted representation"""
+
+    def __init__(self, origin, host, base_url=None, uploader=None, title=None, duration=None, webpage_url=None,
+                 thumbnail=None):
+        self.host = host
+        self.origin = origin
+        self.base_url = base_url
+        self.info = self.Sinfo(uploader, title, duration, webpage_url, thumbnail)
+
+    class Sinfo:
+        def __init__(self, uploader, title, duration, webpage_url, thumbnail):
+            self.uploader = uploader
+            self.title = title
+            self.duration = duration
+            self.webpage_url = webpage_url
+            self.thumbnail = thumbnail
+            self.output = ""
+
+
+def _entry(i: int) -> Tuple:
+    """Fields of a flat playlist entry, built as new strings like every parsed extractor response"""
+    video_id = f"{i:011d}"[-11:]
+    return (
+        linkutils.Origins.Playlist,
+        linkutils.Sites.YouTube,
+        "".join(["Uploader ", str(i % UPLOADERS)]),
+        f"Track number {i} - some artist (official audio)",
+        180 + i % 240,
+        f"https://www.youtube.com/watch?v={video_id}",
+        f"https://i.ytimg.com/vi/{video_id}/hqdefault.jpg",
+    )
+
+
+def _measure(factory: Callable, count: int) -> Tuple[List, int]:
+    gc.collect()
+    tracemalloc.start()
+    songs = []
+    for i in range(count):
+        origin, host, uploader, title, duration, url, thumbnail = _entry(i)
+        songs.append(factory(origin, host, uploader=uploader, title=title, duration=duration,
+                             webpage_url=url, thumbnail=thumbnail))
+    gc.collect()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return songs, size
+
+
+def bench(count: int):
+    legacy, legacy_size = _measure(LegacySong, count)
+    songs, slotted_size = _measure(Song, count)
+    print(f"{count} queued tracks: dict-based {legacy_size / 2 ** 20:.1f} MiB, "
+          f"slotted {slotted_size / 2 ** 20:.1f} MiB "
+          f"({legacy_size / count:.0f} -> {slotted_size / count:.0f} bytes per track)")
+
+    started = time.perf_counter()
+    pickled = pickle.dumps(legacy, protocol=pickle.HIGHEST_PROTOCOL)
+    pickle_time = time.perf_counter() - started
+    started = time.perf_counter()
+    pickle.loads(pickled)
+    unpickle_time = time.perf_counter() - started
+
+    started = time.perf_counter()
+    packed = pack_songs(songs)
+    pack_time = time.perf_counter() - started
+    started = time.perf_counter()
+    unpacked = unpack_songs(packed)
+    unpack_time = time.perf_counter() - started
+    assert [s.info.webpage_url for s in unpacked] == [s.info.webpage_url for s in songs]
+
+    print(f"pickle of the dict-based tracks: {len(pickled) / 2 ** 20:.1f} MiB, "
+          f"dump {pickle_time:.3f}s, load {unpickle_time:.3f}s")
+    print(f"pack_songs: {len(packed) / 2 ** 20:.1f} MiB, pack {pack_time:.3f}s, unpack {unpack_time:.3f}s")
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 100_000)
@@ -0,0 +1,150 @@
+"""
+Bytes downloaded and time per lookup of the Spotify track title resolver against the old
+implementation, which downloaded the whole page and parsed it with BeautifulSoup.
+
+By default a local server stands in for open.spotify.com. It serves a page of `page_kib` KiB with
+the <title> in its head, like a track page, in 16 KiB writes and counts the bytes it sent before
+the client closed the connection. With --live the track url is fetched from Spotify, and the
+bytes are counted as they were read.
+
+    python benchmarks/spotify_title.py [lookups] [page_kib]
+    python benchmarks/spotify_title.py --live https://open.spotify.com/track/<id>
+"""
+import asyncio
+import os
+import sys
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    Tuple,
+)
+
+import aiohttp
+from aiohttp import web
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config  # noqa: E402
+from cores.musicbot import linkutils  # noqa: E402
+
+WRITE_SIZE = 16 * 1024
+TITLE = "Never Gonna Give You Up - song by Rick Astley | Spotify"
+
+
+def _page(page_kib: int) -> bytes:
+    head = (
+        '<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"/>'
+        '<meta name="viewport" content="width=device-width, initial-scale=1"/>'
+        + '<meta property="og:site_name" content="Spotify"/>' * 20
+        + f'<title>{TITLE}</title>'
+        + '<link rel="preload" href="https://open.spotifycdn.com/cdn/build/web-player/vendor.js" as="script"/>' * 10
+        + '</head><body><div id="main"></div><script id="initial-state" type="text/plain">'
+    ).encode()
+    tail = b'</script></body></html>'
+    return head + b"A" * max(page_kib * 1024 - len(head) - len(tail), 0) + tail
+
+
+async def old_convert_spotify(session: aiohttp.ClientSession, url: str) -> Tuple[str, int]:
+    """linkutils.convert_spotify before the resolver, returns the title and the bytes read"""
+    async with session.get(url) as response:
+        page = await response.text()
+        soup = BeautifulSoup(page, 'html.parser')
+
+        title = soup.find('title')
+        title = title.string
+        title = title.replace('- song by', '')
+        title = title.replace('| Spotify', '')
+
+        return title, len(page.encode())
+
+
+async def _time(lookup: Callable[[int], Awaitable[None]], lookups: int) -> float:
+    started = time.perf_counter()
+    for i in range(lookups):
+        await lookup(i)
+    return (time.perf_counter() - started) / lookups
+
+
+async def bench_local(lookups: int, page_kib: int):
+    page = _page(page_kib)
+    sent: Dict[str, int] = {}
+
+    async def handle(request: web.Request) -> web.StreamResponse:
+        response = web.StreamResponse(headers={'Content-Type': 'text/html; charset=utf-8'})
+        response.content_length = len(page)
+        await response.prepare(request)
+        key = request.query['run']
+        try:
+            for offset in range(0, len(page), WRITE_SIZE):
+                chunk = page[offset:offset + WRITE_SIZE]
+                await response.write(chunk)
+                sent[key] = sent.get(key, 0) + len(chunk)
+                # lets the client read in between, as it would over a network
+                await asyncio.sleep(0.001)
+        except (ConnectionResetError, asyncio.CancelledError):
+            pass
+        return response
+
+    app = web.Application()
+    app.router.add_get('/track', handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    base = f"http://127.0.0.1:{port}/track"
+
+    async with aiohttp.ClientSession() as session:
+        async def old_lookup(i: int):
+            await old_convert_spotify(session, f"{base}?run=old{i}")
+
+        old_time = await _time(old_lookup, lookups)
+
+    async def new_lookup(i: int):
+        assert await linkutils.convert_spotify(f"{base}?run=new{i}") is not None
+
+    new_time = await _time(new_lookup, lookups)
+    cached_time = await _time(lambda i: linkutils.convert_spotify(f"{base}?run=new0"), lookups)
+    await linkutils.close_session()
+    # the server notices the closed connections on its next writes
+    await asyncio.sleep(0.1)
+    await runner.cleanup()
+
+    old_bytes = sum(v for k, v in sent.items() if k.startswith('old')) / lookups
+    new_bytes = sum(v for k, v in sent.items() if k.startswith('new')) / lookups
+    print(f"{page_kib} KiB page, {lookups} lookups, bytes sent per lookup and time per lookup:")
+    print(f"  full page + BeautifulSoup  {old_bytes / 1024:8.1f} KiB  {old_time * 1e3:7.2f}ms")
+    print(f"  resolver                   {new_bytes / 1024:8.1f} KiB  {new_time * 1e3:7.2f}ms")
+    print(f"  resolver, cached title     {0:8.1f} KiB  {cached_time * 1e3:7.3f}ms")
+
+
+async def bench_live(url: str):
+    async with aiohttp.ClientSession(headers={'User-Agent': config.CRAWLER_AGENT}) as session:
+        started = time.perf_counter()
+        title, old_bytes = await old_convert_spotify(session, url)
+        old_time = time.perf_counter() - started
+        print(f"full page + BeautifulSoup  {old_bytes / 1024:8.1f} KiB  {old_time * 1e3:7.1f}ms  {title!r}")
+
+        # the resolver's reading loop, counting what it read
+        started = time.perf_counter()
+        page = b""
+        async with session.get(url) as response:
+            async for chunk in response.content.iter_chunked(4096):
+                page += chunk
+                if linkutils.title_regex.search(page) or b"</head>" in page:
+                    break
+        new_time = time.perf_counter() - started
+        print(f"resolver                   {len(page) / 1024:8.1f} KiB  {new_time * 1e3:7.1f}ms")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 2 and sys.argv[1] == '--live':
+        asyncio.run(bench_live(sys.argv[2]))
+    else:
+        asyncio.run(bench_local(
+            int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+            int(sys.argv[2]) if len(sys.argv) > 2 else 300
+        ))
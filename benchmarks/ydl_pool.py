@@ -0,0 +1,77 @@
+"""
+Per-call overhead of building a YoutubeDL for every request against checking one out of YoutubeDLPool.
+
+Each call does what every extraction needs before touching the network: it gets the YoutubeDL, loads
+the cookie file and looks up the YouTube extractor. Without config.COOKIE_PATH a temporary cookie
+file with `cookies` entries is used.
+
+    python benchmarks/ydl_pool.py [calls] [cookies]
+"""
+import os
+import sys
+import tempfile
+import time
+
+import yt_dlp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config  # noqa: E402
+from cores.musicbot.extractor import (  # noqa: E402
+    SEARCH_OPTIONS,
+    SONG_OPTIONS,
+    YoutubeDLPool,
+)
+
+
+def _write_cookies(path: str, count: int):
+    with open(path, 'w') as f:
+        f.write("# Netscape HTTP Cookie File\n")
+        for i in range(count):
+            f.write(f".youtube.com\tTRUE\t/\tTRUE\t2000000000\tcookie{i}\t{'x' * 64}\n")
+
+
+def _use(ydl: yt_dlp.YoutubeDL):
+    ydl.cookiejar
+    ydl.get_info_extractor('Youtube')
+
+
+def bench(calls: int, cookies: int):
+    cookie_path = config.COOKIE_PATH
+    temp_dir = None
+    if not os.path.exists(cookie_path):
+        temp_dir = tempfile.TemporaryDirectory()
+        cookie_path = os.path.join(temp_dir.name, 'cookies.txt')
+        _write_cookies(cookie_path, cookies)
+
+    for name, options in (('song', SONG_OPTIONS), ('search', SEARCH_OPTIONS)):
+        options = {**options, 'cookiefile': cookie_path, 'quiet': True}
+
+        started = time.perf_counter()
+        for _ in range(calls):
+            with yt_dlp.YoutubeDL(dict(options)) as ydl:
+                _use(ydl)
+        fresh = (time.perf_counter() - started) / calls
+
+        pool = YoutubeDLPool(4)
+        started = time.perf_counter()
+        pool.warm(options)
+        warm = time.perf_counter() - started
+        started = time.perf_counter()
+        for _ in range(calls):
+            with pool.checkout(options) as ydl:
+                _use(ydl)
+        pooled = (time.perf_counter() - started) / calls
+
+        print(f"{name} options: new YoutubeDL per call {fresh * 1e3:.2f}ms, "
+              f"pooled {pooled * 1e3:.3f}ms ({fresh / pooled:.0f}x), warming 4 instances {warm * 1e3:.0f}ms")
+
+    if temp_dir is not None:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    bench(
+        int(sys.argv[1]) if len(sys.argv) > 1 else 50,
+        int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    )
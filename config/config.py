@@ -2,6 +2,9 @@ import os
 
 SPOTIFY_ID: str = ""
 SPOTIFY_SECRET: str = ""
+SPOTIFY_RESOLVE_CONCURRENCY = 8  # tracks of an imported playlist matched to YouTube at the same time
+SPOTIFY_MATCH_CACHE_SIZE = 5000  # ISRC/title -> YouTube video id matches kept in memory
+SPOTIFY_TITLE_CACHE_SIZE = 5000  # Spotify track id -> title kept in memory
 
 BOT_PREFIX = "87"
 
@@ -11,10 +14,56 @@ SUPPORTED_EXTENSIONS = ('.webm', '.mp4', '.mp3', '.avi', '.wav', '.m4v', '.ogg',
 
 MAX_SONG_PRELOAD = 15  # maximum of 25
 
+QUEUE_PAGE_SIZE = 10  # songs per queue page, embeds are limited to 25 fields
+QUEUE_PAGE_CACHE_SIZE = 8  # rendered queue pages kept per guild
+QUEUE_VIEW_TIMEOUT = 120  # seconds the queue page buttons stay active
+PRELOAD_WORKERS = 2  # songs preloaded at the same time, across all guilds
+
+EXTRACTOR_WORKERS = 4  # yt_dlp calls running at the same time
+EXTRACTOR_USE_PROCESSES = False  # run yt_dlp in worker processes instead of threads
+
+TRACK_CACHE_SIZE = 2000  # resolved tracks kept in memory
+STREAM_URL_EXPIRY_MARGIN = 300  # seconds, treat stream urls as expired this long before their expire=
+
+STREAM_REVALIDATE_INTERVAL = 120  # seconds between stream url checks of queued songs
+
+DATABASE_POOL_MIN_SIZE = 2  # connections opened at startup
+DATABASE_POOL_MAX_SIZE = 10  # connections shared by all database handlers
+DATABASE_HEALTH_CHECK_INTERVAL = 60  # seconds between pings of the database
+DATABASE_COMMAND_TIMEOUT = 30  # seconds
+DATABASE_SLOW_QUERY_THRESHOLD = 0.25  # seconds, slower queries are logged
+MIGRATIONS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../migrations'))
+MIGRATION_LOCK_ID = 7214038  # advisory lock held while migrating, any bigint not used by other applications
+
+SESSION_FLUSH_INTERVAL = 15  # seconds between writes of changed playback sessions
+SETTINGS_FLUSH_INTERVAL = 30  # seconds between writes of changed guild settings
+
+AUDIO_CACHE_ENABLED = False  # keep the audio of frequently played tracks on disk
+AUDIO_CACHE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../audio_cache'))
+AUDIO_CACHE_MAX_BYTES = 2 * 1024 ** 3  # evict the least recently played files above this size
+AUDIO_CACHE_MIN_PLAYS = 3  # plays after which a track is downloaded
+
+SEARCH_CACHE_SIZE = 5000  # search queries kept in memory
+SEARCH_CACHE_TTL = 60 * 60 * 24  # seconds
+SEARCH_CACHE_NEGATIVE_TTL = 60 * 10  # seconds, for queries without results
+
 COOKIE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'cookies/cookies.txt'))
 
 GLOBAL_DISABLE_AUTOJOIN_VC = False
 
+GAPLESS_PREOPEN_SECONDS = 10  # open and prime the next track this long before the current one ends
+OPUS_PASSTHROUGH = True  # send Opus streams without re-encoding while the volume is 100%
+GAIN_RAMP_FRAMES = 10  # 20ms frames a volume change is spread over
+
+# scale tracks to the target loudness once it was measured. Off by default: a scaled track is decoded,
+# scaled and re-encoded instead of passed through, which costs ~50x the CPU per stream. Only tracks in
+# the audio cache are measured, from their file, so it also needs AUDIO_CACHE_ENABLED
+LOUDNESS_NORMALIZATION = False
+LOUDNESS_TARGET = -14.0  # LUFS
+LOUDNESS_MAX_GAIN = 6.0  # dB, quiet tracks are boosted at most this much
+LOUDNESS_TOLERANCE = 1.0  # dB, tracks this close to the target play unscaled and can be passed through
+LOUDNESS_CACHE_SIZE = 5000  # measured tracks kept in memory
+
 VC_TIMEOUT = 600  # seconds
 VC_TIMOUT_DEFAULT = True  # default template setting for VC timeout true= yes, timeout false= no timeout
 ALLOW_VC_TIMEOUT_EDIT = True  # allow or disallow editing the vc_timeout guild setting
@@ -47,6 +96,7 @@ SONGINFO_QUEUE_ADDED = "Added to queue"
 SONGINFO_SONGINFO = "Song info"
 SONGINFO_ERROR = "Error: Unsupported site or age restricted content. To enable age restricted content check the documentation/wiki."
 SONGINFO_PLAYLIST_QUEUED = "Queued playlist :page_with_curl:"
+SESSION_RESTORED_MESSAGE = "Restored the last session, its {} songs play after this one :leftwards_arrow_with_hook:"
 SONGINFO_UNKNOWN_DURATION = "Unknown"
 
 HELP_ADDBOT_SHORT = "Add Bot to another server"
@@ -86,7 +136,7 @@ HELP_CLEAR_LONG = "Clears the queue and skips the current song."
 HELP_LOOP_SHORT = "Loops the currently playing song, toggle on/off. Aliases: ['l']"
 HELP_LOOP_LONG = "Loops the currently playing song and locks the queue. Use the command again to disable loop."
 HELP_QUEUE_SHORT = "Shows the songs in queue. Aliases: ['playlist', 'q']"
-HELP_QUEUE_LONG = "Shows the number of songs in queue, up to 10."
+HELP_QUEUE_LONG = f"Shows the songs in queue, page by page. Usage: {BOT_PREFIX}queue [page]"
 HELP_SHUFFLE_SHORT = "Shuffle the queue. Aliases: ['sh']"
 HELP_SHUFFLE_LONG = "Randomly sort the songs in the current queue"
 HELP_CHANGECHANNEL_SHORT = "Change the bot channel"
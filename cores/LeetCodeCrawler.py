@@ -2,7 +2,6 @@ import os.path
 from datetime import time
 from pathlib import Path
 from typing import (
-    Any,
     List,
     Literal,
     Optional,
@@ -144,44 +143,28 @@ class LeetCodeMentionChannel(object):
 
 
 class LeetCodeDatabaseHandler(DatabaseHandlerBase):
-    _table_name = "leetcode"
-    _create_table_sql = """
-        CREATE TABLE leetcode (
-            guild_id bigint PRIMARY KEY,
-            target_time time not null,
-            message_channel bigint not null,
-            thread_channel bigint
-        );"""
-
-    def __init__(self, dsn: Any):
-        super(LeetCodeDatabaseHandler, self).__init__(dsn)
-
-    def update_notification(self, mention_channel: LeetCodeMentionChannel):
-        with self.conn:
-            with self.conn.cursor() as cur:
-                sql = """
-                    INSERT INTO leetcode
-                    (guild_id, target_time, message_channel, thread_channel)
-                    VALUES (%s, %s, %s, %s)
-                    ON CONFLICT (guild_id) DO UPDATE 
-                    SET target_time = excluded.target_time,
-                        message_channel = excluded.message_channel,
-                        thread_channel = excluded.thread_channel;"""
-                cur.execute(sql, tuple(mention_channel))
-
-    def remove_notification(self, guild_id: int):
-        with self.conn:
-            with self.conn.cursor() as cur:
-                sql = "DELETE FROM leetcode WHERE guild_id=%s;"
-                cur.execute(sql, (guild_id,))
-
-    def get_mention_channels(self) -> List[LeetCodeMentionChannel]:
-        with self.conn:
-            with self.conn.cursor() as cur:
-                cur.execute("SELECT * FROM leetcode WHERE True;")
-                mention_channels = []
-                for d in cur:
-                    mention_channels.append(
-                        LeetCodeMentionChannel(*d)
-                    )
+    def __init__(self):
+        super(LeetCodeDatabaseHandler, self).__init__()
+
+    async def update_notification(self, mention_channel: LeetCodeMentionChannel):
+        sql = """
+            INSERT INTO leetcode
+            (guild_id, target_time, message_channel, thread_channel)
+            VALUES ($1, $2, $3, $4)
+            ON CONFLICT (guild_id) DO UPDATE 
+            SET target_time = excluded.target_time,
+                message_channel = excluded.message_channel,
+                thread_channel = excluded.thread_channel;"""
+        await self.db.execute('leetcode.update', sql, *mention_channel)
+
+    async def remove_notification(self, guild_id: int):
+        sql = "DELETE FROM leetcode WHERE guild_id=$1;"
+        await self.db.execute('leetcode.remove', sql, guild_id)
+
+    async def get_mention_channels(self) -> List[LeetCodeMentionChannel]:
+        mention_channels = []
+        for d in await self.db.fetch('leetcode.list', "SELECT * FROM leetcode WHERE True;"):
+            mention_channels.append(
+                LeetCodeMentionChannel(*d)
+            )
         return mention_channels
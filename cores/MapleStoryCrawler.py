@@ -1,4 +1,7 @@
-from typing import Any
+from typing import (
+    Iterable,
+    Set,
+)
 
 import aiohttp
 from bs4 import BeautifulSoup
@@ -50,35 +53,30 @@ class MapleStoryEventCrawler:
 
 
 class MapleStoryDatabaseHandler(DatabaseHandlerBase):
-    _table_name = "maple_story_event"
-    _create_table_sql = """
-            CREATE TABLE maple_story_event (
-                id serial PRIMARY KEY , 
-                bullentinId int not null 
-            );"""
-
-    def __init__(self, dsn: Any):
-        super(MapleStoryDatabaseHandler, self).__init__(dsn)
+    def __init__(self):
+        super(MapleStoryDatabaseHandler, self).__init__()
 
-    def add_found_event(self, bullentin_id: int):
+    async def add_found_events(self, bullentin_ids: Iterable[int]) -> Set[int]:
         """
-        Adds bullentinId to the table to avoid sending duplicate messages.
-        :param bullentin_id:  int Event page ID
-        :return:
+        Adds the bullentinIds to the table to avoid sending duplicate messages.
+        :param bullentin_ids: Iterable[int] Event page IDs
+        :return: Set[int] the IDs which weren't in the table yet
         """
-        with self.conn.cursor() as cur:
-            cur.execute(
-                """INSERT INTO maple_story_event (bullentinId) VALUES (%s);""",
-                (bullentin_id,)
-            )
+        records = await self.db.fetch(
+            'maple_story_event.add',
+            """
+            INSERT INTO maple_story_event (bullentinId)
+            SELECT unnest($1::int[])
+            ON CONFLICT (bullentinId) DO NOTHING
+            RETURNING bullentinId;""",
+            list(bullentin_ids)
+        )
+        return {r['bullentinid'] for r in records}
 
-    def is_new_event(self, bullentin_id: int) -> bool:
+    async def get_found_events(self) -> Set[int]:
         """
-        Gets whether this bullentinId is new event or not.
-        :param bullentin_id: int
-        :return: bool
+        Gets all bullentinIds already sent.
+        :return: Set[int]
         """
-        with self.conn.cursor() as cur:
-            cur.execute(f"SELECT * FROM maple_story_event WHERE bullentinId=%s", (bullentin_id,))
-            events = cur.fetchall()
-        return len(events) == 0
+        records = await self.db.fetch('maple_story_event.list', "SELECT bullentinId FROM maple_story_event;")
+        return {r['bullentinid'] for r in records}
@@ -1,21 +1,40 @@
 import asyncio
 import datetime
-from datetime import time
+import heapq
+import itertools
+import time
 from typing import (
     Any,
-    Coroutine,
+    Awaitable,
+    Callable,
+    Dict,
     List,
     Optional,
     Tuple,
 )
-from uuid import uuid4
+from uuid import (
+    UUID,
+    uuid4,
+)
 
 from dateutil import tz
 from discord.ext.commands import Bot
 
 from cores.classes import DatabaseHandlerBase
 
-Schedule = Tuple[str, int, time, str, bool]
+Schedule = Tuple[str, int, datetime.time, str, bool]
+
+
+def normalize_schedule_id(schedule_id: str) -> Optional[str]:
+    """Schedule ids are kept in the dashed form Postgres returns, None if it isn't a uuid"""
+    try:
+        return str(UUID(schedule_id))
+    except ValueError:
+        return None
+
+
+def _to_schedule(record) -> Schedule:
+    return str(record['id']), record['channel_id'], record['target_time'], record['msg'], record['repeat']
 
 
 def get_sleep_time(target_time: datetime.time) -> float:
@@ -30,82 +49,177 @@ def get_sleep_time(target_time: datetime.time) -> float:
     return sleep_time
 
 
+class _Entry(object):
+    __slots__ = ('schedule_id', 'due', 'payload', 'interval', 'cancelled')
+
+    def __init__(self, schedule_id: str, due: float, payload: Any, interval: Optional[float]):
+        self.schedule_id = schedule_id
+        self.due = due
+        self.payload = payload
+        self.interval = interval
+        self.cancelled = False
+
+
+class Scheduler(object):
+    """ Calls the callback with a schedule's payload at its due time, repeating it every interval seconds.
+
+            One background task serves every schedule. Due times are kept in a min-heap and the
+            index maps schedule ids to their entries, so adding is O(log n) and cancelling doesn't
+            search. Cancelled entries are only marked and dropped when they reach the top of the
+            heap, or all at once when they make up half of it, so the heap stays proportional to
+            the live schedules.
+
+            Attributes:
+                callback: Coroutine function awaited with the payload of each due schedule.
+        """
+
+    def __init__(self, callback: Callable[[Any], Awaitable[None]]):
+        self.callback = callback
+        self._index: Dict[str, _Entry] = {}
+        self._heap: List[Tuple[float, int, _Entry]] = []
+        self._sequence = itertools.count()
+        self._cancelled = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __contains__(self, schedule_id: str) -> bool:
+        return schedule_id in self._index
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+    def add(self, schedule_id: str, due: float, payload: Any, interval: Optional[float] = None):
+        """Schedules the payload at the due time (time.time()), replacing a schedule with the same id"""
+        self.cancel(schedule_id)
+        entry = _Entry(schedule_id, due, payload, interval)
+        self._index[schedule_id] = entry
+        self._push(entry)
+
+    def cancel(self, schedule_id: str) -> bool:
+        entry = self._index.pop(schedule_id, None)
+        if entry is None:
+            return False
+        entry.cancelled = True
+        self._cancelled += 1
+        if self._cancelled > len(self._heap) // 2:
+            self._heap = [item for item in self._heap if not item[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled = 0
+        return True
+
+    def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def _push(self, entry: _Entry):
+        heapq.heappush(self._heap, (entry.due, next(self._sequence), entry))
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        if self._heap[0][2] is entry:
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            due, _, entry = self._heap[0]
+            if entry.cancelled:
+                heapq.heappop(self._heap)
+                self._cancelled -= 1
+                continue
+
+            delay = due - time.time()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            heapq.heappop(self._heap)
+            if entry.interval is None:
+                del self._index[entry.schedule_id]
+            else:
+                entry.due += entry.interval
+                self._push(entry)
+            asyncio.create_task(self._fire(entry))
+
+    async def _fire(self, entry: _Entry):
+        try:
+            await self.callback(entry.payload)
+        except Exception as e:
+            print(f"Schedule {entry.payload} failed: {e}")
+
+
 class ScheduleHandler:
-    def __init__(self, bot: Bot, dsn: Any):
+    def __init__(self, bot: Bot):
         self.bot = bot
-        self.schedule_db_handler = ScheduleDatabaseHandler(dsn)
+        self.schedule_db_handler = ScheduleDatabaseHandler()
+        self.scheduler = Scheduler(self._send)
 
-    async def _run_schedule(self, target_time: datetime.time, callback: Coroutine, repeat: bool = False):
-        sleep_time = get_sleep_time(target_time)
-        # print(sleep_time)
-        await asyncio.sleep(sleep_time)
-        await callback
+    async def _send(self, schedule: Schedule):
+        schedule_id, channel_id, _, msg, repeat = schedule
+        try:
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                print(f"Channel {channel_id} of schedule {schedule_id} not found")
+                return
+            # a new coroutine for every firing
+            await channel.send(msg)
+        finally:
+            if not repeat:
+                await self.schedule_db_handler.remove_schedule(schedule_id)
 
-        while repeat:
-            await asyncio.sleep(86400)  # one day
-            await callback
-        else:
-            current_task = asyncio.tasks.current_task(self.bot.loop)
-            schedule_id = current_task.get_name()
-            success = self.schedule_db_handler.remove_schedule(schedule_id)
+    def _add(self, schedule: Schedule):
+        due = time.time() + get_sleep_time(schedule[2])
+        self.scheduler.add(schedule[0], due, schedule, 86400 if schedule[4] else None)  # one day
 
-    async def create_schedule(self, channel_id: int, target_time: time, msg: str, repeat: bool = False) -> bool:
-        channel = self.bot.get_channel(channel_id)
-        schedule_id = self.schedule_db_handler.create_schedule(channel_id, target_time, msg, repeat)
+    async def create_schedule(
+            self, channel_id: int, target_time: datetime.time, msg: str, repeat: bool = False
+    ) -> bool:
+        schedule_id = await self.schedule_db_handler.create_schedule(channel_id, target_time, msg, repeat)
         if schedule_id is None:
             return False
         else:
-            self.bot.loop.create_task(
-                self._run_schedule(target_time, channel.send(msg), repeat),
-                name=schedule_id
-            )
+            self._add((schedule_id, channel_id, target_time, msg, repeat))
             return True
 
-    def remove_schedule(self, schedule_id: str) -> bool:
-        for task in asyncio.tasks.all_tasks(self.bot.loop):
-            if task.get_name() == schedule_id:
-                task.cancel()
-                self.schedule_db_handler.remove_schedule(schedule_id)
-                return True
-        else:
+    async def remove_schedule(self, schedule_id: str) -> bool:
+        schedule_id = normalize_schedule_id(schedule_id)
+        if schedule_id is None or not self.scheduler.cancel(schedule_id):
             return False
+        await self.schedule_db_handler.remove_schedule(schedule_id)
+        return True
 
-    def list_schedule(self) -> str:
+    async def list_schedule(self) -> str:
         data_msg = "\n".join([
             f"Schedule_id: {schedule[0]}\tTime: {schedule[2]}\tmsg: {schedule[3]}"
-            for schedule in self.schedule_db_handler.list_schedules()
+            for schedule in await self.schedule_db_handler.list_schedules()
         ])
         return data_msg
 
-    def load_schedule_from_database(self):
-        for schedule in self.schedule_db_handler.list_schedules():
-            channel = self.bot.get_channel(schedule[1])
+    async def load_schedule_from_database(self):
+        for schedule in await self.schedule_db_handler.list_schedules():
+            if schedule[0] not in self.scheduler:
+                self._add(schedule)
 
-            self.bot.loop.create_task(
-                self._run_schedule(
-                    schedule[2],
-                    channel.send(schedule[3]),
-                    schedule[4]
-                ),
-                name=schedule[0]
-            )
+    def close(self):
+        self.scheduler.close()
 
 
 class ScheduleDatabaseHandler(DatabaseHandlerBase):
-    _table_name = "schedules"
-    _create_table_sql = """
-        CREATE TABLE schedules (
-            id uuid PRIMARY KEY, 
-            channel_id bigint not null , 
-            target_time time not null , 
-            msg varchar not null ,
-            repeat bool not null );
-    """
-
-    def __init__(self, dsn: Any):
-        super(ScheduleDatabaseHandler, self).__init__(dsn)
-
-    def create_schedule(self, channel_id: int, target_time: time, msg: str, repeat: bool) -> Optional[str]:
+    def __init__(self):
+        super(ScheduleDatabaseHandler, self).__init__()
+
+    async def create_schedule(
+            self, channel_id: int, target_time: datetime.time, msg: str, repeat: bool
+    ) -> Optional[str]:
         """
         Creates a schedule data in the database
         :param channel_id: int (use to send message)
@@ -114,57 +228,48 @@ class ScheduleDatabaseHandler(DatabaseHandlerBase):
         :param repeat: bool
         :return:
         """
-        schedule_id = uuid4().hex
-
-        with self.conn:
-            with self.conn.cursor() as cur:
-                cur.execute(
-                    """INSERT INTO schedules (id, channel_id, target_time, msg, repeat) VALUES (%s, %s, %s, %s, %s);""",
-                    (schedule_id, channel_id, target_time, msg, repeat)
-                )
+        schedule_id = str(uuid4())
+
+        await self.db.execute(
+            'schedules.create',
+            """INSERT INTO schedules (id, channel_id, target_time, msg, repeat) VALUES ($1, $2, $3, $4, $5);""",
+            schedule_id, channel_id, target_time, msg, repeat
+        )
         return schedule_id
 
-    def remove_schedule(self, schedule_id: str) -> bool:
+    async def remove_schedule(self, schedule_id: str) -> bool:
         """
         Removes the schedule with schedule_id
         :param schedule_id: str
         :return: bool
         """
-        with self.conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(
-                    """
-                    WITH deleted AS 
-                            (DELETE FROM schedules WHERE id=%s RETURNING *) 
-                    SELECT count(*) 
-                    FROM deleted;""",
-                    (schedule_id,)
-                )
-                success = cur.fetchall()[0][0] == 1
-        return success
-
-    def get_schedule(self, schedule_id: str) -> Optional[Schedule]:
+        deleted = await self.db.fetchval(
+            'schedules.remove',
+            """
+            WITH deleted AS 
+                    (DELETE FROM schedules WHERE id=$1 RETURNING *) 
+            SELECT count(*) 
+            FROM deleted;""",
+            schedule_id
+        )
+        return deleted == 1
+
+    async def get_schedule(self, schedule_id: str) -> Optional[Schedule]:
         """
         Gets a schedule with schedule_id
         :param schedule_id:
         :return: Optional[Schedule]
         """
-        with self.conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"SELECT * FROM schedules WHERE id=%s", (schedule_id,))
-                schedule = cur.fetchall()
-        if len(schedule) == 0:
+        schedule = await self.db.fetchrow('schedules.get', "SELECT * FROM schedules WHERE id=$1", schedule_id)
+        if schedule is None:
             return None
         else:
-            return schedule[0]
+            return _to_schedule(schedule)
 
-    def list_schedules(self) -> List[Schedule]:
+    async def list_schedules(self) -> List[Schedule]:
         """
         List all schedule in database
         :return: List[Schedule]
         """
-        with self.conn as conn:
-            with conn.cursor() as cur:
-                cur.execute(f"SELECT * FROM schedules WHERE True")
-                schedule = cur.fetchall()
-        return schedule
+        schedules = await self.db.fetch('schedules.list', "SELECT * FROM schedules WHERE True")
+        return [_to_schedule(schedule) for schedule in schedules]
@@ -0,0 +1,233 @@
+import asyncio
+import os
+import re
+import time
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+import asyncpg
+
+from config import config
+from cores import metrics
+
+# a query failing with one of these is retried once on a fresh connection, if that can't run it twice
+_CONNECTION_ERRORS = (asyncpg.PostgresConnectionError, asyncpg.InterfaceError, OSError)
+
+migration_file_regex = re.compile(r"^(\d+)_(\w+)\.sql$")
+status_rows_regex = re.compile(r"(\d+)$")
+
+
+def _is_read_only(sql: str) -> bool:
+    return sql.lstrip().upper().startswith('SELECT')
+
+
+def _redact(method: str, args: Sequence) -> str:
+    """Describes the parameters by their types only, they may hold user content"""
+    if method == 'executemany':
+        return f"[{len(args[0])} parameter sets]"
+    return "(" + ", ".join(f"${i}={type(arg).__name__}" for i, arg in enumerate(args, 1)) + ")"
+
+
+def _row_count(method: str, args: Sequence, result: Any) -> int:
+    """Rows returned by a fetch, or affected by an execute according to its status, e.g. 'INSERT 0 3'"""
+    if method == 'fetch':
+        return len(result)
+    if method in ('fetchrow', 'fetchval'):
+        return 0 if result is None else 1
+    if method == 'executemany':
+        return len(args[0])
+    match = status_rows_regex.search(result or '')
+    return int(match.group(1)) if match else 0
+
+
+def load_migrations(directory: str) -> List[Tuple[int, str, str]]:
+    """Reads the numbered migrations, e.g. 0002_constraints_and_types.sql, as (version, name, sql) in order"""
+    migrations = []
+    for file_name in os.listdir(directory):
+        match = migration_file_regex.match(file_name)
+        if match is None:
+            continue
+        with open(os.path.join(directory, file_name), encoding='utf-8') as f:
+            migrations.append((int(match.group(1)), match.group(2), f.read()))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(versions) != len(set(versions)):
+        raise ValueError(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+class Database(object):
+    """ One bounded asyncpg connection pool shared by every database handler.
+
+            The pool is opened and warmed up once at startup. A background task checks it on an
+            interval and drops the connections of a failed check, so they are reopened on their
+            next use. Reads failing on a broken connection are retried once, writes only when no
+            connection could be acquired, as they may have been committed before it dropped.
+
+            Every query is named after its table and purpose, e.g. schedules.list. Its latency is
+            recorded in the db.<name> histogram and its rows in the db.<name>.rows counter,
+            queries slower than DATABASE_SLOW_QUERY_THRESHOLD are logged without their parameters.
+
+            Attributes:
+                min_size: Connections opened at startup and kept open.
+                max_size: Maximum number of connections.
+                health_check_interval: Seconds between health checks.
+        """
+
+    def __init__(self, min_size: int, max_size: int, health_check_interval: float):
+        self.min_size = min_size
+        self.max_size = max_size
+        self.health_check_interval = health_check_interval
+        self.pool: Optional[asyncpg.Pool] = None
+        self._close_hooks: List[Callable[[], Awaitable[None]]] = []
+        self._health_check: Optional[asyncio.Task] = None
+
+    async def connect(self, dsn: Any):
+        """Opens the pool with its minimum number of connections and checks that it works"""
+        self.pool = await asyncpg.create_pool(
+            dsn,
+            min_size=self.min_size,
+            max_size=self.max_size,
+            command_timeout=config.DATABASE_COMMAND_TIMEOUT
+        )
+        await self.pool.fetchval("SELECT 1;")
+        self._health_check = asyncio.get_event_loop().create_task(self._check_health())
+
+    async def _check_health(self):
+        while True:
+            await asyncio.sleep(self.health_check_interval)
+            try:
+                await self.pool.fetchval("SELECT 1;")
+            except Exception as e:
+                print(f"Database health check failed, reconnecting: {e}")
+                await self.pool.expire_connections()
+
+    async def _call(self, method: str, sql: str, *args) -> Any:
+        """
+        Retries once when no connection could be acquired, the statement wasn't sent then.
+        Once sent, only reads are retried, a write may have been committed before the connection dropped.
+        """
+        retried = False
+        while True:
+            try:
+                conn = await self.pool.acquire()
+            except _CONNECTION_ERRORS as e:
+                if retried:
+                    raise
+                print(f"Could not connect to the database, retrying: {e}")
+                await self.pool.expire_connections()
+                retried = True
+                continue
+
+            try:
+                return await getattr(conn, method)(sql, *args)
+            except _CONNECTION_ERRORS as e:
+                await self.pool.expire_connections()
+                if retried or not _is_read_only(sql):
+                    raise
+                print(f"Database connection lost, retrying: {e}")
+                retried = True
+            finally:
+                await self.pool.release(conn)
+
+    async def _run(self, method: str, name: str, sql: str, *args) -> Any:
+        started = time.perf_counter()
+        try:
+            result = await self._call(method, sql, *args)
+        except Exception:
+            metrics.counter(f'db.{name}.errors').inc()
+            raise
+        finally:
+            self._observe(name, time.perf_counter() - started, sql, _redact(method, args))
+        metrics.counter(f'db.{name}.rows').inc(_row_count(method, args, result))
+        return result
+
+    @staticmethod
+    def _observe(name: str, elapsed: float, sql: str, params: str):
+        metrics.histogram(f'db.{name}').observe(elapsed)
+        if elapsed >= config.DATABASE_SLOW_QUERY_THRESHOLD:
+            metrics.counter('db.slow_queries').inc()
+            print(f"Slow query {name} took {elapsed:.3f}s: {' '.join(sql.split())} {params}")
+
+    async def execute(self, name: str, sql: str, *args) -> str:
+        return await self._run('execute', name, sql, *args)
+
+    async def executemany(self, name: str, sql: str, args: Iterable[Sequence]):
+        return await self._run('executemany', name, sql, list(args))
+
+    async def fetch(self, name: str, sql: str, *args) -> List[asyncpg.Record]:
+        return await self._run('fetch', name, sql, *args)
+
+    async def fetchrow(self, name: str, sql: str, *args) -> Optional[asyncpg.Record]:
+        return await self._run('fetchrow', name, sql, *args)
+
+    async def fetchval(self, name: str, sql: str, *args) -> Any:
+        return await self._run('fetchval', name, sql, *args)
+
+    @asynccontextmanager
+    async def transaction(self, name: str) -> AsyncIterator[asyncpg.Connection]:
+        """Runs the queries of the block on one connection in one transaction, timed as a whole"""
+        started = time.perf_counter()
+        try:
+            async with self.pool.acquire() as conn:
+                async with conn.transaction():
+                    yield conn
+        except Exception:
+            metrics.counter(f'db.{name}.errors').inc()
+            raise
+        finally:
+            self._observe(name, time.perf_counter() - started, 'transaction', '')
+
+    async def migrate(self, directory: str = config.MIGRATIONS_DIR):
+        """
+        Applies the migrations newer than the schema version in one transaction.
+        Concurrently starting bots wait for the advisory lock, so only the first one migrates.
+        :param directory: str folder of the numbered .sql files
+        :return:
+        """
+        migrations = load_migrations(directory)
+        async with self.transaction('schema_version.migrate') as conn:
+            await conn.execute("SELECT pg_advisory_xact_lock($1);", config.MIGRATION_LOCK_ID)
+            await conn.execute("""
+                CREATE TABLE IF NOT EXISTS schema_version (
+                    version int PRIMARY KEY,
+                    name varchar not null,
+                    applied_at timestamptz not null default now()
+                );""")
+            current = await conn.fetchval("SELECT coalesce(max(version), 0) FROM schema_version;")
+            for version, name, sql in migrations:
+                if version <= current:
+                    continue
+                print(f'Applying migration {version:04d}_{name}...')
+                await conn.execute(sql)
+                await conn.execute("INSERT INTO schema_version (version, name) VALUES ($1, $2);", version, name)
+                current = version
+            print(f'Database schema at version {current}')
+
+    def on_close(self, hook: Callable[[], Awaitable[None]]):
+        """Registers a coroutine function, e.g. flushing pending writes, awaited before the pool closes"""
+        self._close_hooks.append(hook)
+
+    async def close(self):
+        for hook in self._close_hooks:
+            try:
+                await hook()
+            except Exception as e:
+                print(f"Could not finish pending writes: {e}")
+        if self._health_check is not None:
+            self._health_check.cancel()
+        if self.pool is not None:
+            await self.pool.close()
+
+
+database = Database(config.DATABASE_POOL_MIN_SIZE, config.DATABASE_POOL_MAX_SIZE, config.DATABASE_HEALTH_CHECK_INTERVAL)
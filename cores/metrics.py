@@ -0,0 +1,92 @@
+import bisect
+from typing import (
+    Callable,
+    Dict,
+    List,
+    Sequence,
+)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+class Counter(object):
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount: int = 1):
+        self.value += amount
+
+
+class Histogram(object):
+    """Cumulative latency histogram with fixed bucket bounds (in seconds)."""
+
+    def __init__(self, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    @property
+    def mean(self) -> float:
+        return self.sum / self.count if self.count else 0.0
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket holding the q-th quantile."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.max
+
+
+_counters: Dict[str, Counter] = {}
+_histograms: Dict[str, Histogram] = {}
+_gauges: Dict[str, Callable[[], float]] = {}
+
+
+def counter(name: str) -> Counter:
+    if name not in _counters:
+        _counters[name] = Counter()
+    return _counters[name]
+
+
+def histogram(name: str, buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+    if name not in _histograms:
+        _histograms[name] = Histogram(buckets)
+    return _histograms[name]
+
+
+def gauge(name: str, getter: Callable[[], float]):
+    """Registers a gauge whose value is read from `getter` at export time."""
+    _gauges[name] = getter
+
+
+def export(prefix: str = '') -> str:
+    """Formats the metrics whose name starts with `prefix`, one per line."""
+    lines: List[str] = []
+    for name, c in sorted(_counters.items()):
+        if name.startswith(prefix):
+            lines.append(f"{name} {c.value}")
+    for name, getter in sorted(_gauges.items()):
+        if name.startswith(prefix):
+            lines.append(f"{name} {getter()}")
+    for name, h in sorted(_histograms.items()):
+        if not name.startswith(prefix):
+            continue
+        lines.append(
+            f"{name} count={h.count} mean={h.mean:.3f}s "
+            f"p50<={h.quantile(0.5)}s p95<={h.quantile(0.95)}s max={h.max:.3f}s"
+        )
+    return "\n".join(lines)
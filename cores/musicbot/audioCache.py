@@ -0,0 +1,160 @@
+import asyncio
+import os
+from collections import OrderedDict
+from typing import (
+    Optional,
+    Set,
+)
+
+import yt_dlp
+
+from config import config
+from cores import metrics
+from cores.musicbot.cache import LRUCache
+from cores.musicbot.songInfo import Song
+
+# only Opus is cached, so cached files can always be passed through
+DOWNLOAD_OPTIONS = {
+    'format': 'bestaudio[acodec=opus]',
+    'noplaylist': True,
+    'quiet': True,
+    'overwrites': True,
+    "cookiefile": config.COOKIE_PATH
+}
+_SUFFIX = '.webm'
+
+
+def _download(url: str, path: str) -> int:
+    """Downloads the audio next to path and moves it in place once complete, returns its size"""
+    temp_path = path + '.part'
+    with yt_dlp.YoutubeDL({**DOWNLOAD_OPTIONS, 'outtmpl': temp_path}) as ydl:
+        ydl.download([url])
+    os.replace(temp_path, path)
+    return os.path.getsize(path)
+
+
+class AudioCache(object):
+    """ Keeps the audio of frequently played YouTube tracks on disk.
+
+            A track is downloaded in the background once it was played min_plays times, files
+            are evicted least recently played first when the cache grows past max_bytes. The
+            modification time of a file is its last play, so the order survives restarts.
+
+            Attributes:
+                directory: Where the audio files are stored.
+                max_bytes: Size budget of all files together.
+                min_plays: Plays after which a track is downloaded.
+        """
+
+    def __init__(self, directory: str, max_bytes: int, min_plays: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.size = 0
+        self._files: "Optional[OrderedDict[str, int]]" = None
+        self._plays = LRUCache(config.TRACK_CACHE_SIZE)
+        self._downloading: Set[str] = set()
+        self._lock = asyncio.Lock()
+
+        metrics.gauge('audio_cache.bytes', lambda: self.size)
+
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.directory, video_id + _SUFFIX)
+
+    def _load(self) -> "OrderedDict[str, int]":
+        """Indexes the files already on disk, oldest play first"""
+        if self._files is not None:
+            return self._files
+
+        os.makedirs(self.directory, exist_ok=True)
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith('.part'):
+                os.remove(entry.path)
+            elif entry.name.endswith(_SUFFIX):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, entry.name[:-len(_SUFFIX)], stat.st_size))
+
+        self._files = OrderedDict()
+        for _, video_id, size in sorted(entries):
+            self._files[video_id] = size
+            self.size += size
+        return self._files
+
+    def __contains__(self, song: Song) -> bool:
+        if not config.AUDIO_CACHE_ENABLED or song.info.video_id is None:
+            return False
+        return song.info.video_id in self._load()
+
+    def get(self, song: Song) -> Optional[str]:
+        """Returns the path of the song's audio file and marks it as recently played"""
+        if song not in self:
+            metrics.counter('audio_cache.miss').inc()
+            return None
+
+        video_id = song.info.video_id
+        self._files.move_to_end(video_id)
+        path = self._path(video_id)
+        try:
+            os.utime(path)
+        except OSError:
+            self.discard(song)
+            return None
+        metrics.counter('audio_cache.hit').inc()
+        return path
+
+    def discard(self, song: Song):
+        """Removes the song's file, e.g. because it could not be played"""
+        video_id = song.info.video_id
+        if self._files is None or video_id not in self._files:
+            return
+        self.size -= self._files.pop(video_id)
+        try:
+            os.remove(self._path(video_id))
+        except OSError:
+            pass
+
+    def record_play(self, song: Song):
+        """Counts a play of the song and starts its download once it is played often enough"""
+        video_id = song.info.video_id
+        if not config.AUDIO_CACHE_ENABLED or video_id is None:
+            return
+        if video_id in self._load() or video_id in self._downloading:
+            return
+
+        plays = self._plays.get(video_id, 0) + 1
+        self._plays.put(video_id, plays)
+        if plays >= self.min_plays:
+            self._downloading.add(video_id)
+            asyncio.create_task(self._fetch(video_id, song.info.webpage_url))
+
+    async def _fetch(self, video_id: str, url: str):
+        loop = asyncio.get_running_loop()
+        try:
+            # one download at a time, they are background work
+            async with self._lock:
+                size = await loop.run_in_executor(None, _download, url, self._path(video_id))
+        except Exception as e:
+            print(f"Could not cache the audio of {url}: {e}")
+            return
+        finally:
+            self._downloading.discard(video_id)
+
+        self._files[video_id] = size
+        self.size += size
+        self._plays.pop(video_id)
+        metrics.counter('audio_cache.download').inc()
+        self._evict()
+
+    def _evict(self):
+        while self.size > self.max_bytes and len(self._files) > 1:
+            video_id, size = self._files.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self._path(video_id))
+            except OSError:
+                pass
+            metrics.counter('audio_cache.evict').inc()
+
+
+audio_cache = AudioCache(config.AUDIO_CACHE_DIR, config.AUDIO_CACHE_MAX_BYTES, config.AUDIO_CACHE_MIN_PLAYS)
@@ -1,10 +1,13 @@
 import asyncio
+import time
+from collections import deque
+from typing import (
+    Optional,
+    Tuple,
+)
 
-import discord
-import yt_dlp
 from discord import (
     Guild,
-    PCMVolumeTransformer,
     VoiceClient,
 )
 from discord.ext.commands import (
@@ -12,13 +15,46 @@ from discord.ext.commands import (
 )
 
 from config import config
+from cores import metrics
 from cores.musicbot import (
     linkutils,
     utils,
 )
+from cores.musicbot.audioCache import audio_cache
+from cores.musicbot.extractor import (
+    extractor,
+    PLAYLIST_OPTIONS,
+)
+from cores.musicbot.idleTimer import idle_timer
+from cores.musicbot.loudness import (
+    loudness_cache,
+    normalization_gain,
+)
 from cores.musicbot.playlist import Playlist
+from cores.musicbot.preloader import preloader
+from cores.musicbot.queueView import QueuePages
+from cores.musicbot.revalidator import revalidator
+from cores.musicbot.sessions import SessionData
 from cores.musicbot.settings import Settings
-from cores.musicbot.songInfo import Song
+from cores.musicbot.songInfo import (
+    pack_songs,
+    Song,
+    unpack_songs,
+)
+from cores.musicbot.sources import (
+    ffmpeg_source,
+    FFMPEG_BEFORE_OPTIONS,
+    GainTransformer,
+    PrimedAudio,
+)
+from cores.musicbot.spotify import (
+    spotify_importer,
+    SpotifyTrack,
+)
+from cores.musicbot.trackCache import (
+    stream_expires_within,
+    stream_is_opus,
+)
 
 
 class AudioController(object):
@@ -32,13 +68,24 @@ class AudioController(object):
 
     def __init__(self, guild: Guild, settings: Settings):
         self.playlist = Playlist()
+        self.queue_pages = QueuePages(self.playlist, guild.id)
         self.current_song = None
         self.guild = guild
+        self.playlist_import: Optional[asyncio.Task] = None
+
+        self._preopen_task: Optional[asyncio.Task] = None
+        self._preopened: Optional[Tuple[Song, PrimedAudio]] = None
+        self._ended_at: Optional[float] = None
+        self._source: Optional[PrimedAudio] = None
+        self._resume_at: Optional[Tuple[Song, int]] = None
+        self._restored = False
+        self._starting = False
 
         self.sett = settings
         self._volume = self.sett.get('default_volume')
 
-        self.timer = utils.Timer(self.timeout_handler)
+        idle_timer.register(guild.id, self.timeout_handler)
+        revalidator.watch(self)
 
     @property
     def volume(self):
@@ -50,7 +97,16 @@ class AudioController(object):
         voice_client = self.guild.voice_client
         if not isinstance(voice_client, VoiceClient):
             raise Exception("Should be VoiceClient")
-        voice_client.source = PCMVolumeTransformer(voice_client.source, float(value) / 100.0)
+        source = voice_client.source
+        if isinstance(source, GainTransformer):
+            source.volume = float(value) / 100.0
+        elif source is not None and source.is_opus() and not self._passthrough(1.0):
+            # Opus packets can't be scaled, continue the song decoded to PCM
+            asyncio.create_task(self._reopen_as_pcm())
+
+    def _passthrough(self, normalization: float) -> bool:
+        """Whether Opus sources can be sent as they are, which needs the gain at 1"""
+        return config.OPUS_PASSTHROUGH and self._volume == 100 and normalization == 1.0
 
     def track_history(self):
         history_string = config.INFO_HISTORY_TITLE
@@ -59,56 +115,205 @@ class AudioController(object):
         return history_string
 
     def next_song(self, error: Exception, ctx: Context):
-        """Invoked after a song is finished. Plays the next song if there is one."""
+        """Invoked in the player thread after a song is finished, the playlist is only touched on the event loop"""
+        ended_at = time.perf_counter()
+        ctx.bot.loop.call_soon_threadsafe(self._next_song, ended_at, ctx)
+
+    def _next_song(self, ended_at: float, ctx: Context):
+        """Plays the next song if there is one."""
         next_song: Song = self.playlist.next(self.current_song)
 
         self.current_song = None
 
         if next_song is None:
+            self._discard_preopened()
             return
 
-        coro = self.play_song(next_song, ctx)
-        ctx.bot.loop.create_task(coro)
+        self._ended_at = ended_at
+        # no song plays until play_song started the next one, nothing else may start one meanwhile
+        self._starting = True
+
+        # a pre-opened source turns the transition into a source swap
+        source = self._take_preopened(next_song)
+        asyncio.create_task(self.play_song(next_song, ctx, source))
 
-    async def play_song(self, song: Song, ctx: Context):
+    async def play_song(self, song: Song, ctx: Context, source: Optional[PrimedAudio] = None):
         """Plays a song object"""
+        # set until the voice client plays the song, a song queued meanwhile must not start the head again
+        self._starting = True
+        try:
+            await self._play_song(song, ctx, source)
+        finally:
+            self._starting = False
 
+    async def _play_song(self, song: Song, ctx: Context, source: Optional[PrimedAudio]):
         if self.playlist.loop:  # let timer run through if looping
-            self.timer.cancel()
-            self.timer = utils.Timer(self.timeout_handler)
+            idle_timer.touch(self.guild.id)
+
+        if source is None:
+            if song not in audio_cache:
+                await preloader.claim(song)
+                # resolves the song unless it was preloaded already
+                await utils.preload(song, self.guild.id)
+            source = await self._open_source(song, self._take_resume(song))
 
-        if song.info.title is None:
-            if song.host == linkutils.Sites.Spotify:
-                conversion = utils.search_youtube(await linkutils.convert_spotify(song.info.webpage_url))
-                song.info.webpage_url = conversion
-            utils.get_song_info(song)
+        try:
+            voice_client = self.guild.voice_client
+            if not isinstance(voice_client, VoiceClient):
+                raise Exception("Should be VoiceClient")
+
+            if source.is_opus() and not self._passthrough(source.normalization):
+                # pre-opened before the volume changed
+                source.cleanup()
+                source = await self._open_source(song)
+
+            source.on_start = self._record_gap
+            player_source = source
+            if not source.is_opus():
+                player_source = GainTransformer(source, float(self.volume) / 100.0, source.normalization)
+            voice_client.play(player_source, after=lambda e: self.next_song(e, ctx))
+        except BaseException:
+            # stops the primed FFmpeg process
+            source.cleanup()
+            raise
+        self._source = source
+        audio_cache.record_play(song)
 
         self.playlist.add_name(song.info.title)
         self.current_song = song
-
         self.playlist.play_history.append(self.current_song)
+        self.playlist.take(song)
+
+        self.preload_queue()
+        self._schedule_preopen(song)
+
         await ctx.send(embed=song.info.format_output(config.SONGINFO_NOW_PLAYING))
 
-        voice_client = self.guild.voice_client
-        if not isinstance(voice_client, VoiceClient):
-            raise Exception("Should be VoiceClient")
-        voice_client.play(
-            discord.FFmpegPCMAudio(
-                song.base_url,
-                before_options='-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
-            ),
-            after=lambda e: self.next_song(e, ctx)
+    async def _open_source(self, song: Song, start: int = 0) -> PrimedAudio:
+        """Spawns FFmpeg for the song and waits for its first frame, refreshing the stream url if it failed"""
+        loop = asyncio.get_running_loop()
+        seek_options = f"-ss {start}" if start > 0 else None
+        normalization = normalization_gain(await loudness_cache.get(song))
+        passthrough = self._passthrough(normalization)
+
+        if (path := audio_cache.get(song)) is not None:
+            source = PrimedAudio(ffmpeg_source(path, seek_options, passthrough), start, normalization)
+            if await loop.run_in_executor(None, source.prime):
+                # measured from the file on disk, never from a second download of the stream
+                loudness_cache.measure(song, path)
+                return source
+            print(f"Cached audio of {song.info.webpage_url} is unreadable, streaming it")
+            source.cleanup()
+            audio_cache.discard(song)
+            await utils.preload(song, self.guild.id)
+
+        if stream_expires_within(song.base_url, config.STREAM_URL_EXPIRY_MARGIN):
+            await utils.get_song_info(song, self.guild.id, force=True)
+
+        before_options = FFMPEG_BEFORE_OPTIONS
+        if seek_options is not None:
+            before_options = f"{seek_options} {before_options}"
+
+        source = PrimedAudio(
+            ffmpeg_source(song.base_url, before_options, passthrough and stream_is_opus(song.base_url)),
+            start, normalization
         )
-
-        self.guild.voice_client.source = discord.PCMVolumeTransformer(
-            self.guild.voice_client.source
+        if await loop.run_in_executor(None, source.prime):
+            return source
+
+        # an expired or revoked url (403) produces no audio at all, retry once with a fresh one
+        print(f"Stream of {song.info.webpage_url} produced no audio, refreshing")
+        metrics.counter('stream.refresh_on_error').inc()
+        source.cleanup()
+        await utils.get_song_info(song, self.guild.id, force=True)
+        source = PrimedAudio(
+            ffmpeg_source(song.base_url, before_options, passthrough and stream_is_opus(song.base_url)),
+            start, normalization
         )
-        self.guild.voice_client.source.volume = float(self.volume) / 100.0
+        await loop.run_in_executor(None, source.prime)
+        return source
 
-        self.playlist.play_deque.popleft()
+    async def _reopen_as_pcm(self):
+        """Swaps the playing Opus source for a PCM one continuing at the same position"""
+        song, old_source = self.current_song, self._source
+        if song is None or old_source is None:
+            return
+        try:
+            source = await self._open_source(song, int(old_source.position))
+        except Exception as e:
+            print(f"Could not reopen {song.info.webpage_url}: {e}")
+            return
 
-        for song in list(self.playlist.play_deque)[:config.MAX_SONG_PRELOAD]:
-            asyncio.ensure_future(utils.preload(song))
+        voice_client = self.guild.voice_client
+        if (
+            source.is_opus() or self.current_song is not song
+            or not isinstance(voice_client, VoiceClient) or voice_client.source is not old_source
+        ):
+            # the volume went back to 100% or the song ended meanwhile
+            source.cleanup()
+            return
+        voice_client.source = GainTransformer(source, float(self.volume) / 100.0, source.normalization)
+        self._source = source
+        old_source.cleanup()
+
+    def _take_resume(self, song: Song) -> int:
+        """Returns the position a restored song continues at, once it plays"""
+        if self._resume_at is None or self._resume_at[0] is not song:
+            return 0
+        position = self._resume_at[1]
+        self._resume_at = None
+        return position
+
+    def _schedule_preopen(self, song: Song):
+        if self._preopen_task is not None:
+            self._preopen_task.cancel()
+        self._preopen_task = None
+        if song.info.duration is not None:
+            self._preopen_task = asyncio.create_task(self._preopen_next(song.info.duration))
+
+    async def _preopen_next(self, duration: float):
+        """Opens and primes the next song's source shortly before the current one ends"""
+        await asyncio.sleep(max(0.0, duration - config.GAPLESS_PREOPEN_SECONDS))
+        if self.playlist.loop or len(self.playlist) == 0:
+            return
+
+        next_song = self.playlist.play_deque[0]
+        try:
+            if next_song not in audio_cache:
+                await preloader.claim(next_song)
+                await utils.preload(next_song, self.guild.id)
+                if next_song.base_url is None:
+                    return
+            source = await self._open_source(next_song)
+        except Exception as e:
+            print(f"Could not pre-open the next song: {e}")
+            return
+
+        self._discard_preopened()
+        self._preopened = (next_song, source)
+
+    def _take_preopened(self, song: Song) -> Optional[PrimedAudio]:
+        preopened, self._preopened = self._preopened, None
+        if preopened is None:
+            return None
+        preopened_song, source = preopened
+        if preopened_song is not song:
+            source.cleanup()
+            return None
+        return source
+
+    def _discard_preopened(self):
+        if self._preopened is not None:
+            self._preopened[1].cleanup()
+            self._preopened = None
+
+    def _record_gap(self):
+        if self._ended_at is None:
+            return
+        gap = time.perf_counter() - self._ended_at
+        self._ended_at = None
+        metrics.histogram('playback.gap').observe(gap)
+        print(f"{self.guild.id}: {gap * 1000:.0f} ms gap between tracks")
 
     async def process_song(self, track: str, ctx: Context):
         """Adds the track to the playlist instance and plays it, if it is the first song"""
@@ -118,11 +323,20 @@ class AudioController(object):
 
         if is_playlist != linkutils.PlaylistTypes.Unknown and is_playlist != linkutils.PlaylistTypes.YouTube_Music_Playlist:
             await ctx.send("Processing playlist...")
-            await self.process_playlist(is_playlist, track)
-
-            if self.current_song is None:
-                await self.play_song(self.playlist.play_deque[0], ctx)
-                print(f"Playing {track}")
+            self.cancel_import()
+            queued = asyncio.Event()
+            task = asyncio.create_task(self.process_playlist(is_playlist, track, ctx, queued))
+            task.add_done_callback(self._import_done)
+            self.playlist_import = task
+            # returns once the first entry is queued, which starts playback. The rest is imported in the
+            # background, stop/clear may cancel it and _import_done reports its errors
+            first_entry = asyncio.create_task(queued.wait())
+            try:
+                await asyncio.wait({task, first_entry}, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                first_entry.cancel()
+            if not queued.is_set() and not task.cancelled() and task.exception() is not None:
+                return None
 
             return Song(
                 linkutils.Origins.Playlist,
@@ -133,75 +347,144 @@ class AudioController(object):
             if linkutils.get_url(track) is not None:
                 return None
 
-            track = utils.search_youtube(track)
+            track = await utils.search_youtube(track, self.guild.id)
 
         if host == linkutils.Sites.YouTube:
             track = track.split("&list=")[0]
 
-        downloader = yt_dlp.YoutubeDL({
-            'format': 'bestaudio',
-            'title': True,
-            "cookiefile": config.COOKIE_PATH
-        })
-
         try:
-            r = downloader.extract_info(track, download=False)
+            data = await utils.resolve_track(track, self.guild.id)
         except Exception as e:
             print(str(e))
             return None
 
-        if r.get('thumbnails') is not None:
-            thumbnail = r.get('thumbnails')[len(r.get('thumbnails')) - 1]['url']
-        else:
-            thumbnail = None
-
         song = Song(
             linkutils.Origins.Default,
             host,
-            base_url=r.get('url'),
-            uploader=r.get('uploader'),
-            title=r.get('title'),
-            duration=r.get('duration'),
-            webpage_url=r.get('webpage_url'),
-            thumbnail=thumbnail
+            base_url=data['stream_url'],
+            uploader=data['uploader'],
+            title=data['title'],
+            duration=data['duration'],
+            webpage_url=data['webpage_url'],
+            thumbnail=data['thumbnail']
         )
 
-        self.playlist.add(song)
-        if self.current_song is None:
+        restored = self._add_requested(song)
+        if restored:
+            await ctx.send(config.SESSION_RESTORED_MESSAGE.format(restored))
+        if self.current_song is None and not self._starting:
             print(f"Playing {track}")
-            await self.play_song(song, ctx)
+            await self._start_playback(ctx)
 
         return song
 
-    async def process_playlist(self, playlist_type: linkutils.PlaylistTypes, url: str):
+    async def process_playlist(self, playlist_type: linkutils.PlaylistTypes, url: str, ctx: Context,
+                               queued: asyncio.Event):
+        """Queues the entries of the playlist as they arrive and starts playing with the first one, setting queued"""
         if playlist_type == linkutils.PlaylistTypes.YouTube_Playlist:
-            options = {
-                'format': 'bestaudio/best',
-                'extract_flat': True,
-                "cookiefile": config.COOKIE_PATH
-            }
-
-            with yt_dlp.YoutubeDL(options) as ydl:
-                r = ydl.extract_info(url, download=False)
-                if 'entries' not in r:
-                    r = ydl.extract_info(r['url'], download=False)
-                for entry in r['entries']:
-                    link = f"https://www.youtube.com/watch?v={entry['id']}"
-
-                    song = Song(
-                        linkutils.Origins.Playlist,
-                        linkutils.Sites.YouTube,
-                        webpage_url=link
-                    )
-
-                    self.playlist.add(song)
-
-        for song in list(self.playlist.play_deque)[:config.MAX_SONG_PRELOAD]:
-            asyncio.ensure_future(utils.preload(song))
+            async for entry in extractor.iter_playlist(url, PLAYLIST_OPTIONS, self.guild.id):
+                link = f"https://www.youtube.com/watch?v={entry['id']}"
+
+                if entry.get('thumbnails'):
+                    thumbnail = entry.get('thumbnails')[-1]['url']
+                else:
+                    thumbnail = None
+
+                # keeps the flat metadata so the queue shows titles without extra extraction
+                song = Song(
+                    linkutils.Origins.Playlist,
+                    linkutils.Sites.YouTube,
+                    uploader=entry.get('uploader') or entry.get('channel'),
+                    title=entry.get('title'),
+                    duration=entry.get('duration'),
+                    webpage_url=link,
+                    thumbnail=thumbnail
+                )
+                self._queue_imported(song, url, ctx, queued)
+
+        elif playlist_type == linkutils.PlaylistTypes.Spotify_Playlist:
+            semaphore = asyncio.Semaphore(config.SPOTIFY_RESOLVE_CONCURRENCY)
+
+            async def resolve(track: SpotifyTrack) -> Optional[Song]:
+                async with semaphore:
+                    try:
+                        link = await spotify_importer.resolve(track, self.guild.id)
+                    except Exception as e:
+                        print(str(e))
+                        return None
+                if link is None:
+                    return None
+                return Song(
+                    linkutils.Origins.Playlist,
+                    linkutils.Sites.YouTube,
+                    title=track['title'],
+                    duration=track['duration'],
+                    webpage_url=link
+                )
+
+            # tracks resolve concurrently but are queued in playlist order
+            pending = deque()
+            try:
+                async for spotify_track in spotify_importer.iter_tracks(url, self.guild.id):
+                    pending.append(asyncio.create_task(resolve(spotify_track)))
+                    if len(pending) >= config.SPOTIFY_RESOLVE_CONCURRENCY * 4:
+                        await asyncio.wait({pending[0]})
+                    while pending and pending[0].done():
+                        if (song := pending.popleft().result()) is not None:
+                            self._queue_imported(song, url, ctx, queued)
+                while pending:
+                    if (song := await pending[0]) is not None:
+                        self._queue_imported(song, url, ctx, queued)
+                    pending.popleft()
+            finally:
+                for task in pending:
+                    task.cancel()
+
+        self.preload_queue()
+
+    def _queue_imported(self, song: Song, url: str, ctx: Context, queued: asyncio.Event):
+        restored = self._add_requested(song)
+        queued.set()
+        if restored:
+            asyncio.create_task(ctx.send(config.SESSION_RESTORED_MESSAGE.format(restored)))
+        if self.current_song is None and not self._starting:
+            print(f"Playing {url}")
+            self._starting = True
+            asyncio.create_task(self._start_playback(ctx))
+        elif len(self.playlist) <= config.MAX_SONG_PRELOAD:
+            self.preload_queue()
+
+    def _add_requested(self, song: Song) -> int:
+        """Queues a requested song, returns the number of restored songs it was queued ahead of"""
+        if not self._restored or self.current_song is not None or self._starting:
+            self.playlist.add(song)
+            return 0
+        # the song starting playback goes first, the restored session continues after it
+        self._restored = False
+        self.playlist.play_deque.appendleft(song)
+        return len(self.playlist) - 1
+
+    def _import_done(self, task: asyncio.Task):
+        if self.playlist_import is task:
+            self.playlist_import = None
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Could not import the playlist: {task.exception()}")
+
+    async def _start_playback(self, ctx: Context):
+        """Plays the head of the queue, the song just requested"""
+        await self.play_song(self.playlist.play_deque[0], ctx)
+
+    def cancel_import(self):
+        """Cancels the running playlist import"""
+        if self.playlist_import is not None:
+            self.playlist_import.cancel()
+            self.playlist_import = None
 
     async def stop_player(self):
         """Stops the player and removes all songs from the queue"""
 
+        self.cancel_import()
+
         voice_client = self.guild.voice_client
         if not isinstance(voice_client, VoiceClient):
             raise Exception("Should be VoiceClient")
@@ -216,8 +499,7 @@ class AudioController(object):
     async def prev_song(self, ctx: Context):
         """Loads the last song from the history into the queue and starts it"""
 
-        self.timer.cancel()
-        self.timer = utils.Timer(self.timeout_handler)
+        idle_timer.touch(self.guild.id)
 
         if len(self.playlist.play_history) == 0:
             return
@@ -238,22 +520,21 @@ class AudioController(object):
     async def timeout_handler(self):
         voice_client = self.guild.voice_client
         if not isinstance(voice_client, VoiceClient):
-            raise Exception("Should be VoiceClient")
-        if len(voice_client.channel.voice_states) == 1:
+            return
+        if idle_timer.is_channel_empty(self.guild.id):
             await self.disconnect()
             return
 
         sett = self.sett
 
         if not sett.get('vc_timeout'):
-            self.timer = utils.Timer(self.timeout_handler)  # restart timer
+            idle_timer.touch(self.guild.id)  # restart timer
             return
 
         if voice_client.is_playing():
-            self.timer = utils.Timer(self.timeout_handler)  # restart timer
+            idle_timer.touch(self.guild.id)  # restart timer
             return
 
-        self.timer = utils.Timer(self.timeout_handler)
         await self.disconnect()
 
     async def is_connected(self):
@@ -273,8 +554,49 @@ class AudioController(object):
         return True
 
     async def disconnect(self):
+        idle_timer.cancel(self.guild.id)
         await self.stop_player()
         await self.guild.voice_client.disconnect(force=True)
 
     def clear_queue(self):
+        self.cancel_import()
+        self._discard_preopened()
+        self._resume_at = None
+        self._restored = False
         self.playlist.play_deque.clear()
+        preloader.cancel(self.guild.id)
+
+    def preload_queue(self):
+        """Preloads the next songs in the queue, dropping preload jobs the queue no longer needs"""
+        preloader.schedule(self.guild.id, self.playlist.page(0, config.MAX_SONG_PRELOAD))
+
+    def session_state(self) -> Tuple[Optional[bytes], int, bool, int]:
+        """Returns the current song, position, loop flag and volume, the part of the session that changes often"""
+        if self.current_song is None:
+            return None, 0, self.playlist.loop, self._volume
+        position = int(self._source.position) if self._source is not None else 0
+        return self.current_song.to_bytes(), position, self.playlist.loop, self._volume
+
+    def snapshot(self) -> SessionData:
+        current, position, loop, volume = self.session_state()
+        return SessionData(
+            guild_id=self.guild.id,
+            queue=pack_songs(self.playlist.play_deque),
+            queue_offset=0,
+            current=current,
+            position=position,
+            loop=loop,
+            volume=volume
+        )
+
+    def restore(self, data: SessionData):
+        """Queues a saved session without playing it, it continues after the next requested song"""
+        # loop is left off, it applied to the song playing before the restart and would block the request
+        songs = unpack_songs(data['queue'], data['queue_offset'])
+        if data['current'] is not None:
+            current = Song.from_bytes(data['current'])
+            songs.insert(0, current)
+            self._resume_at = (current, data['position'])
+        self.playlist.play_deque.extend(songs)
+        self._volume = data['volume']
+        self._restored = bool(songs)
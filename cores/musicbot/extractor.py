@@ -0,0 +1,251 @@
+import asyncio
+import concurrent.futures
+import threading
+import time
+from collections import (
+    deque,
+    OrderedDict,
+)
+from contextlib import contextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+import yt_dlp
+
+from config import config
+from cores import metrics
+
+Job = Tuple[Callable, tuple, asyncio.Future, float, bool]
+
+
+# Opus formats can be sent to discord without re-encoding
+SONG_OPTIONS = {
+    'format': 'bestaudio[acodec=opus]/bestaudio',
+    'title': True,
+    "cookiefile": config.COOKIE_PATH
+}
+PLAYLIST_OPTIONS = {
+    'format': 'bestaudio/best',
+    'extract_flat': True,
+    "cookiefile": config.COOKIE_PATH
+}
+# flat search only returns the id and basic metadata of the results, no formats
+SEARCH_OPTIONS = {
+    'extract_flat': True,
+    'noplaylist': True,
+    "cookiefile": config.COOKIE_PATH
+}
+
+
+def _new_youtube_dl(options: dict) -> yt_dlp.YoutubeDL:
+    # YoutubeDL fills its defaults, some of them sets, into the dict it's given, which is also the pool key
+    return yt_dlp.YoutubeDL(dict(options))
+
+
+class YoutubeDLPool(object):
+    """ Reusable YoutubeDL instances, one free list per option profile.
+
+            Building a YoutubeDL re-initializes the extractor registry and reloads the cookie file,
+            so instances are checked out per call and returned afterwards. An instance is only
+            used by one thread at a time.
+
+            Attributes:
+                size: Maximum number of idle instances kept per option profile.
+        """
+
+    def __init__(self, size: int):
+        self.size = size
+        self._lock = threading.Lock()
+        self._free: Dict[tuple, List[yt_dlp.YoutubeDL]] = {}
+
+    @staticmethod
+    def _key(options: dict) -> tuple:
+        return tuple(sorted(options.items()))
+
+    @contextmanager
+    def checkout(self, options: dict) -> Iterator[yt_dlp.YoutubeDL]:
+        key = self._key(options)
+        with self._lock:
+            free = self._free.setdefault(key, [])
+            ydl = free.pop() if free else None
+        if ydl is None:
+            ydl = _new_youtube_dl(options)
+
+        try:
+            yield ydl
+        finally:
+            with self._lock:
+                if len(free) < self.size:
+                    free.append(ydl)
+
+    def warm(self, options: dict):
+        """Fills the free list of the option profile"""
+        key = self._key(options)
+        with self._lock:
+            missing = self.size - len(self._free.setdefault(key, []))
+        instances = [_new_youtube_dl(options) for _ in range(missing)]
+        with self._lock:
+            self._free[key].extend(instances)
+
+
+ydl_pool = YoutubeDLPool(config.EXTRACTOR_WORKERS)
+
+
+def _extract_info(url: str, options: dict) -> Optional[dict]:
+    with ydl_pool.checkout(options) as ydl:
+        r = ydl.extract_info(url, download=False)
+        return ydl.sanitize_info(r)
+
+
+def _stream_playlist(url: str, options: dict, emit: Callable[[dict], None], stop: threading.Event):
+    with ydl_pool.checkout(options) as ydl:
+        r = ydl.extract_info(url, download=False, process=False)
+        while r.get('_type') in ('url', 'url_transparent'):
+            r = ydl.extract_info(r['url'], download=False, process=False)
+
+        # unprocessed entries are a lazy generator fetching one page at a time
+        for entry in r.get('entries') or ():
+            if stop.is_set():
+                break
+            emit(entry)
+
+
+def _warm(options: dict):
+    ydl_pool.warm(options)
+
+
+class Extractor(object):
+    """ Runs blocking yt_dlp calls on one shared, bounded worker pool.
+
+            Jobs are queued per guild and dispatched round-robin, so a guild queuing
+            a large batch can't starve the others.
+
+            Attributes:
+                workers: Number of jobs executed at the same time.
+                use_processes: Use a process pool instead of a thread pool.
+        """
+
+    def __init__(self, workers: int, use_processes: bool = False):
+        self.workers = workers
+        self.use_processes = use_processes
+
+        self._executor: Optional[concurrent.futures.Executor] = None
+        self._queues: "OrderedDict[int, Deque[Job]]" = OrderedDict()
+        self._pending = 0
+        self._wakeup: Optional[asyncio.Event] = None
+        self._dispatchers = []
+
+        metrics.gauge('extractor.queue_depth', lambda: self.queue_depth)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._pending
+
+    def _start(self):
+        if self._dispatchers:
+            return
+        if self.use_processes:
+            self._executor = concurrent.futures.ProcessPoolExecutor(max_workers=self.workers)
+        else:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=self.workers, thread_name_prefix='extractor'
+            )
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._dispatchers = [loop.create_task(self._dispatch()) for _ in range(self.workers)]
+
+    async def run(self, fn: Callable, *args, guild_id: int = 0, in_thread: bool = False) -> Any:
+        """Runs fn(*args) on the worker pool once it is this guild's turn.
+
+        Jobs with in_thread set use a thread even if the pool runs processes, for
+        functions taking arguments that can't be pickled.
+        """
+        self._start()
+        future = asyncio.get_running_loop().create_future()
+        job = (fn, args, future, time.perf_counter(), in_thread)
+        self._queues.setdefault(guild_id, deque()).append(job)
+        self._pending += 1
+        self._wakeup.set()
+        return await future
+
+    async def extract_info(self, url: str, options: dict, guild_id: int = 0) -> Optional[dict]:
+        return await self.run(_extract_info, url, options, guild_id=guild_id)
+
+    async def iter_playlist(self, url: str, options: dict, guild_id: int = 0) -> AsyncIterator[dict]:
+        """Yields the flat entries of a playlist as its pages arrive"""
+        loop = asyncio.get_running_loop()
+        entries = asyncio.Queue()
+        stop = threading.Event()
+        done = object()
+
+        def emit(entry: dict):
+            loop.call_soon_threadsafe(entries.put_nowait, entry)
+
+        job = asyncio.ensure_future(
+            self.run(_stream_playlist, url, options, emit, stop, guild_id=guild_id, in_thread=True)
+        )
+        job.add_done_callback(lambda _: entries.put_nowait(done))
+        try:
+            while (entry := await entries.get()) is not done:
+                yield entry
+            job.result()
+        finally:
+            # stops the worker thread at the next entry when the import is cancelled
+            stop.set()
+            job.cancel()
+
+    async def warm(self):
+        """Builds the YoutubeDL instances of every option profile ahead of the first request"""
+        await asyncio.gather(*(
+            self.run(_warm, options) for options in (SONG_OPTIONS, PLAYLIST_OPTIONS, SEARCH_OPTIONS)
+        ))
+
+    def _next_job(self) -> Optional[Job]:
+        while self._queues:
+            guild_id, jobs = self._queues.popitem(last=False)
+            job = jobs.popleft()
+            if jobs:
+                # move the guild to the back of the round
+                self._queues[guild_id] = jobs
+            self._pending -= 1
+            if job[2].cancelled():
+                continue
+            return job
+        return None
+
+    async def _dispatch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            fn, args, future, queued_at, in_thread = job
+            executor = None if in_thread and self.use_processes else self._executor
+            started = time.perf_counter()
+            metrics.histogram('extractor.wait').observe(started - queued_at)
+            try:
+                result = await loop.run_in_executor(executor, fn, *args)
+            except Exception as e:
+                metrics.counter('extractor.errors').inc()
+                if not future.done():
+                    future.set_exception(e)
+            else:
+                if not future.done():
+                    future.set_result(result)
+            finally:
+                metrics.histogram('extractor.latency').observe(time.perf_counter() - started)
+
+
+extractor = Extractor(config.EXTRACTOR_WORKERS, config.EXTRACTOR_USE_PROCESSES)
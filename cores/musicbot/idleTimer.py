@@ -0,0 +1,107 @@
+import asyncio
+import heapq
+import time
+from typing import (
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from config import config
+
+
+class IdleTimer(object):
+    """ Calls a guild's timeout handler once the guild was idle for timeout seconds.
+
+            One background task serves every guild. Touching a guild only records the time of
+            its last activity, the heap keeps at most one deadline per guild. Deadlines are
+            checked against the last activity when they are due and pushed back if the guild
+            was touched meanwhile.
+
+            Attributes:
+                timeout: Seconds of inactivity after which the handler is called.
+        """
+
+    def __init__(self, timeout: float):
+        self.timeout = timeout
+        self._handlers: Dict[int, Callable[[], Awaitable[None]]] = {}
+        self._last_activity: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Set[int] = set()
+        self._empty_channels: Set[int] = set()
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, guild_id: int, handler: Callable[[], Awaitable[None]]):
+        self._handlers[guild_id] = handler
+
+    def touch(self, guild_id: int):
+        """Restarts the guild's timeout"""
+        if guild_id not in self._scheduled:
+            self._scheduled.add(guild_id)
+            heapq.heappush(self._heap, (time.monotonic() + self.timeout, guild_id))
+            self._start()
+            if self._heap[0][1] == guild_id:
+                self._wakeup.set()
+        self._last_activity[guild_id] = time.monotonic()
+
+    def cancel(self, guild_id: int):
+        # the heap entry is dropped when it is due
+        self._last_activity.pop(guild_id, None)
+
+    def set_channel_empty(self, guild_id: int, empty: bool):
+        """Records whether the bot is alone in the guild's voice channel"""
+        if empty:
+            self._empty_channels.add(guild_id)
+        else:
+            self._empty_channels.discard(guild_id)
+
+    def is_channel_empty(self, guild_id: int) -> bool:
+        return guild_id in self._empty_channels
+
+    def _start(self):
+        if self._task is None:
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            if not self._heap:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            delay = self._heap[0][0] - time.monotonic()
+            if delay > 0:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            _, guild_id = heapq.heappop(self._heap)
+            last_activity = self._last_activity.get(guild_id)
+            if last_activity is not None and last_activity + self.timeout > time.monotonic():
+                heapq.heappush(self._heap, (last_activity + self.timeout, guild_id))
+                continue
+
+            self._scheduled.discard(guild_id)
+            if last_activity is None:
+                continue
+            del self._last_activity[guild_id]
+            if guild_id in self._handlers:
+                asyncio.create_task(self._expire(guild_id))
+
+    async def _expire(self, guild_id: int):
+        try:
+            await self._handlers[guild_id]()
+        except Exception as e:
+            print(f"Idle timeout of {guild_id} failed: {e}")
+
+
+idle_timer = IdleTimer(config.VC_TIMEOUT)
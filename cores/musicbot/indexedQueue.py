@@ -0,0 +1,232 @@
+import random
+from collections import deque
+from typing import (
+    Any,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+)
+
+
+class _Node(object):
+    __slots__ = ('value', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, value: Any):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left: Optional[_Node] = None
+        self.right: Optional[_Node] = None
+
+
+def _size(node: Optional[_Node]) -> int:
+    return node.size if node is not None else 0
+
+
+def _update(node: _Node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node: Optional[_Node], k: int) -> Tuple[Optional[_Node], Optional[_Node]]:
+    """Splits the tree into its first k items and the rest"""
+    if node is None:
+        return None, None
+    if _size(node.left) >= k:
+        left, node.left = _split(node.left, k)
+        _update(node)
+        return left, node
+    node.right, right = _split(node.right, k - _size(node.left) - 1)
+    _update(node)
+    return node, right
+
+
+def _merge(a: Optional[_Node], b: Optional[_Node]) -> Optional[_Node]:
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a.priority > b.priority:
+        a.right = _merge(a.right, b)
+        _update(a)
+        return a
+    b.left = _merge(a, b.left)
+    _update(b)
+    return b
+
+
+class IndexedQueue(object):
+    """ Sequence backed by an implicit treap (a randomized, size-augmented binary tree).
+
+            Insert, remove and lookup at any position are O(log n), reading a page of k items
+            is O(log n + k) without copying the rest of the queue. It supports the subset of the
+            deque interface the playlist uses. Unlike a deque its operations aren't atomic, it must
+            only be used from the event loop.
+
+            Attributes:
+                version: Incremented on every change of the queue.
+                popped: Number of items removed by popleft, so changes that only dropped the head can be told apart.
+        """
+
+    def __init__(self, iterable: Iterable = ()):
+        self._root: Optional[_Node] = None
+        self.version = 0
+        self.popped = 0
+        self.extend(iterable)
+
+    def __len__(self) -> int:
+        return _size(self._root)
+
+    def __bool__(self) -> bool:
+        return self._root is not None
+
+    def __iter__(self) -> Iterator:
+        return self._iter_from(0)
+
+    def __getitem__(self, index: int) -> Any:
+        index = self._normalize(index)
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node.value
+            else:
+                index -= left + 1
+                node = node.right
+
+    def __delitem__(self, index: int):
+        index = self._normalize(index)
+        left, rest = _split(self._root, index)
+        _, right = _split(rest, 1)
+        self._root = _merge(left, right)
+        self.version += 1
+
+    def _normalize(self, index: int) -> int:
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("queue index out of range")
+        return index
+
+    def _iter_from(self, start: int) -> Iterator:
+        # descend to the start position, keeping the ancestors still to be visited
+        stack: List[_Node] = []
+        node = self._root
+        while node is not None:
+            left = _size(node.left)
+            if start < left:
+                stack.append(node)
+                node = node.left
+            elif start == left:
+                stack.append(node)
+                break
+            else:
+                start -= left + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.value
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def page(self, start: int, stop: int) -> List:
+        """Returns the items in [start, stop)"""
+        start = max(start, 0)
+        items = []
+        if start >= stop:
+            return items
+        for value in self._iter_from(start):
+            items.append(value)
+            if len(items) == stop - start:
+                break
+        return items
+
+    def insert(self, index: int, value: Any):
+        length = len(self)
+        if index < 0:
+            index = max(index + length, 0)
+        index = min(index, length)
+        left, right = _split(self._root, index)
+        self._root = _merge(_merge(left, _Node(value)), right)
+        self.version += 1
+
+    def append(self, value: Any):
+        self._root = _merge(self._root, _Node(value))
+        self.version += 1
+
+    def appendleft(self, value: Any):
+        self._root = _merge(_Node(value), self._root)
+        self.version += 1
+
+    def extend(self, iterable: Iterable):
+        for value in iterable:
+            self.append(value)
+
+    def popleft(self) -> Any:
+        if self._root is None:
+            raise IndexError("pop from an empty queue")
+        first, self._root = _split(self._root, 1)
+        self.version += 1
+        self.popped += 1
+        return first.value
+
+    def clear(self):
+        self._root = None
+        self.version += 1
+
+    def shuffle(self):
+        items = list(self)
+        random.shuffle(items)
+        self.clear()
+        self.extend(items)
+
+
+class IndexedHistory(object):
+    """ Bounded play history with an identity index, so finding a song's position is O(1).
+
+            A song played several times is found at its latest position.
+        """
+
+    def __init__(self):
+        self._items = deque()
+        self._offset = 0
+        self._positions: Dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self) -> Iterator:
+        return iter(self._items)
+
+    def __getitem__(self, index: int) -> Any:
+        return self._items[index]
+
+    def append(self, value: Any):
+        self._positions[id(value)] = self._offset + len(self._items)
+        self._items.append(value)
+
+    def popleft(self) -> Any:
+        value = self._items.popleft()
+        if self._positions.get(id(value)) == self._offset:
+            del self._positions[id(value)]
+        self._offset += 1
+        return value
+
+    def index(self, value: Any) -> int:
+        position = self._positions.get(id(value))
+        if position is None:
+            raise ValueError("song is not in the history")
+        return position - self._offset
+
+    def clear(self):
+        self._items.clear()
+        self._positions.clear()
+        self._offset = 0
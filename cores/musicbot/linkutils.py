@@ -1,3 +1,4 @@
+import html
 import re
 from enum import Enum
 from typing import (
@@ -6,14 +7,33 @@ from typing import (
 )
 
 import aiohttp
-from bs4 import BeautifulSoup
 
 from config import config
+from cores.musicbot.cache import LRUCache
 
 url_regex = re.compile(r"http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*(),]|%[0-9a-fA-F][0-9a-fA-F])+")
+youtube_id_regex = re.compile(r"(?:[?&]v=|youtu\.be/|/shorts/|/embed/)([0-9A-Za-z_-]{11})")
 
-session = aiohttp.ClientSession(
-    headers={'User-Agent': config.CRAWLER_AGENT})
+spotify_track_regex = re.compile(r"open\.spotify\.com/(?:intl-[\w-]+/)?track/([0-9A-Za-z]+)")
+title_regex = re.compile(rb"<title[^>]*>(.*?)</title>", re.IGNORECASE | re.DOTALL)
+
+_session: Optional[aiohttp.ClientSession] = None
+spotify_title_cache = LRUCache(config.SPOTIFY_TITLE_CACHE_SIZE)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """Returns the shared session, created on the running loop when first needed"""
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(headers={'User-Agent': config.CRAWLER_AGENT})
+    return _session
+
+
+async def close_session():
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
 
 
 def clean_sclink(track: str) -> str:
@@ -24,21 +44,48 @@ def clean_sclink(track: str) -> str:
     return track
 
 
-async def convert_spotify(url: str) -> str:
-    if result := url_regex.search(url):
-        if "?si=" in url:
-            url = result.group(0) + "&nd=1"
+async def _read_page_title(url: str) -> Optional[str]:
+    """Reads the page until its <title> has been seen, the rest of the page is never downloaded"""
+    page = b""
+    async with get_session().get(url) as response:
+        async for chunk in response.content.iter_chunked(4096):
+            page += chunk
+            if result := title_regex.search(page):
+                return html.unescape(result.group(1).decode('utf-8', errors='replace')).strip()
+            if b"</head>" in page:
+                break
+    return None
 
-    async with session.get(url) as response:
-        page = await response.text()
-        soup = BeautifulSoup(page, 'html.parser')
 
-        title = soup.find('title')
-        title = title.string
+async def _read_oembed_title(url: str) -> Optional[str]:
+    async with get_session().get("https://open.spotify.com/oembed", params={'url': url}) as response:
+        if response.status != 200:
+            return None
+        data = await response.json()
+    return data.get('title')
+
+
+async def convert_spotify(url: str) -> Optional[str]:
+    if result := spotify_track_regex.search(url):
+        track_id = result.group(1)
+        url = f"https://open.spotify.com/track/{track_id}"
+    else:
+        track_id = url
+
+    if (title := spotify_title_cache.get(track_id)) is not None:
+        return title
+
+    title = await _read_page_title(url)
+    if title is None:
+        title = await _read_oembed_title(url)
+        if title is None:
+            return None
+    else:
         title = title.replace('- song by', '')
         title = title.replace('| Spotify', '')
 
-        return title
+    spotify_title_cache.put(track_id, title)
+    return title
 
 
 def get_url(content: str) -> Optional[str]:
@@ -49,6 +96,15 @@ def get_url(content: str) -> Optional[str]:
         return None
 
 
+def get_video_id(url: Optional[str]) -> Optional[str]:
+    """Returns the YouTube video id of the url, None if it isn't a YouTube video link"""
+    if url is None:
+        return None
+    if result := youtube_id_regex.search(url):
+        return result.group(1)
+    return None
+
+
 class Sites(Enum):
     Spotify = "Spotify"
     Spotify_Playlist = "Spotify Playlist"
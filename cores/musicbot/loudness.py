@@ -0,0 +1,121 @@
+import asyncio
+import re
+from typing import (
+    Optional,
+    Set,
+)
+
+from config import config
+from cores import metrics
+from cores.classes import DatabaseHandlerBase
+from cores.musicbot.cache import LRUCache
+from cores.musicbot.songInfo import Song
+from cores.musicbot.trackCache import get_track_key
+
+integrated_loudness_regex = re.compile(rb"I:\s+(-?\d+(?:\.\d+)?) LUFS")
+
+_UNMEASURED = object()
+
+
+def normalization_gain(loudness: Optional[float]) -> float:
+    """Linear gain bringing a track of the integrated loudness (LUFS) to the target, 1.0 if close enough"""
+    if not config.LOUDNESS_NORMALIZATION or loudness is None:
+        return 1.0
+    gain_db = min(config.LOUDNESS_TARGET - loudness, config.LOUDNESS_MAX_GAIN)
+    if abs(gain_db) < config.LOUDNESS_TOLERANCE:
+        return 1.0
+    return 10 ** (gain_db / 20)
+
+
+async def _measure(path: str) -> Optional[float]:
+    """Runs FFmpeg's EBU R128 filter over the whole file and reads the integrated loudness from its summary"""
+    process = await asyncio.create_subprocess_exec(
+        'ffmpeg', '-nostats', '-hide_banner', '-i', path, '-vn', '-af', 'ebur128', '-f', 'null', '-',
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await process.communicate()
+    results = integrated_loudness_regex.findall(stderr)
+    if process.returncode != 0 or not results:
+        return None
+    # the summary at the end repeats the final value
+    return float(results[-1])
+
+
+class LoudnessCache(object):
+    """ Integrated loudness of tracks, measured once in the background and kept in the track_loudness table.
+
+            Tracks without a measurement play without normalization. Tracks in the audio cache are
+            measured from their file when they are played from it, so it is known from the next play
+            on, streamed tracks are never downloaded a second time just to be measured.
+        """
+
+    def __init__(self, maxsize: int):
+        self._memory = LRUCache(maxsize)
+        self._measuring: Set[str] = set()
+        self._lock = asyncio.Lock()
+        self.db: Optional[LoudnessDatabaseHandler] = None
+
+    async def get(self, song: Song) -> Optional[float]:
+        if not config.LOUDNESS_NORMALIZATION or song.info.webpage_url is None:
+            return None
+
+        key = get_track_key(song.info.webpage_url)
+        loudness = self._memory.get(key)
+        if loudness is None and self.db is not None:
+            loudness = await self.db.get_loudness(key)
+            # remembers tracks without a measurement, measure() replaces the entry
+            self._memory.put(key, _UNMEASURED if loudness is None else loudness)
+
+        if loudness is _UNMEASURED:
+            return None
+        return loudness
+
+    def measure(self, song: Song, path: str):
+        """Measures the song from its cached audio file unless its loudness is known"""
+        if not config.LOUDNESS_NORMALIZATION or song.info.webpage_url is None:
+            return
+        key = get_track_key(song.info.webpage_url)
+        loudness = self._memory.get(key)
+        if (loudness is not None and loudness is not _UNMEASURED) or key in self._measuring:
+            return
+        self._measuring.add(key)
+        asyncio.create_task(self._measure(key, path))
+
+    async def _measure(self, key: str, path: str):
+        try:
+            # one measurement at a time, it reads the whole track
+            async with self._lock:
+                loudness = await _measure(path)
+            if loudness is None:
+                return
+            self._memory.put(key, loudness)
+            metrics.counter('loudness.measured').inc()
+            if self.db is not None:
+                await self.db.save_loudness(key, loudness)
+        except Exception as e:
+            print(f"Could not measure the loudness of {key}: {e}")
+        finally:
+            self._measuring.discard(key)
+
+
+class LoudnessDatabaseHandler(DatabaseHandlerBase):
+    def __init__(self):
+        super(LoudnessDatabaseHandler, self).__init__()
+
+    async def save_loudness(self, track_key: str, loudness: float):
+        await self.db.execute('track_loudness.save', """
+            INSERT INTO track_loudness (track_key, loudness)
+            VALUES ($1, $2)
+            ON CONFLICT (track_key) DO UPDATE
+            SET loudness = excluded.loudness;
+        """, track_key, loudness)
+
+    async def get_loudness(self, track_key: str) -> Optional[float]:
+        return await self.db.fetchval('track_loudness.get', """
+            SELECT loudness
+            FROM track_loudness
+            WHERE track_key = $1;
+        """, track_key)
+
+
+loudness_cache = LoudnessCache(config.LOUDNESS_CACHE_SIZE)
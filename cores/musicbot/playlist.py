@@ -1,7 +1,11 @@
-import random
 from collections import deque
+from typing import List
 
 from config import config
+from cores.musicbot.indexedQueue import (
+    IndexedHistory,
+    IndexedQueue,
+)
 from cores.musicbot.songInfo import Song
 
 
@@ -10,8 +14,8 @@ class Playlist:
 
     def __init__(self):
         # Stores the links of the songs in queue and the ones already played
-        self.play_deque = deque()
-        self.play_history = deque()
+        self.play_deque = IndexedQueue()
+        self.play_history = IndexedHistory()
 
         # A separate history that remembers the names of the tracks that were played
         self.track_name_history = deque()
@@ -21,6 +25,11 @@ class Playlist:
     def __len__(self):
         return len(self.play_deque)
 
+    @property
+    def version(self) -> int:
+        """Changes whenever the queue changes"""
+        return self.play_deque.version
+
     def add_name(self, track_name: str):
         self.track_name_history.append(track_name)
         if len(self.track_name_history) > config.MAX_TRACKNAME_HISTORY_LENGTH:
@@ -42,6 +51,16 @@ class Playlist:
 
         return self.play_deque[0]
 
+    def take(self, song: Song):
+        """Removes a song that started playing from the queue, wherever commands moved it while it was loading"""
+        if self.play_deque and self.play_deque[0] is song:
+            self.play_deque.popleft()
+            return
+        for index, queued in enumerate(self.play_deque):
+            if queued is song:
+                del self.play_deque[index]
+                return
+
     def prev(self, current_song: Song):
         if current_song is None:
             self.play_deque.appendleft(self.play_history[-1])
@@ -52,8 +71,12 @@ class Playlist:
         if current_song is not None:
             self.play_deque.insert(1, current_song)
 
+    def page(self, start: int, stop: int) -> List[Song]:
+        """Returns the queued songs in [start, stop) without copying the whole queue"""
+        return self.play_deque.page(start, stop)
+
     def shuffle(self):
-        random.shuffle(self.play_deque)
+        self.play_deque.shuffle()
 
     def move(self, old_index: int, new_index: int):
         temp = self.play_deque[old_index]
@@ -0,0 +1,167 @@
+import asyncio
+import heapq
+import itertools
+from typing import (
+    Dict,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from config import config
+from cores import metrics
+from cores.musicbot import utils
+from cores.musicbot.songInfo import Song
+
+
+class PreloadJob(object):
+    __slots__ = ('song', 'guild_id', 'priority', 'task', 'cancelled', 'shown')
+
+    def __init__(self, song: Song, guild_id: int, priority: int):
+        self.song = song
+        self.guild_id = guild_id
+        self.priority = priority
+        self.task: Optional[asyncio.Task] = None
+        self.cancelled = False
+        # requested by the queue view, kept when the guild's preloads change
+        self.shown = False
+
+
+class PreloadScheduler(object):
+    """ Single long-lived preload queue shared by every guild.
+
+            Jobs are ordered by queue position (the next track first), de-duplicated per Song
+            and dropped once the guild's queue changes so they are no longer needed. Songs the
+            queue view shows without a title are resolved after them.
+
+            Attributes:
+                workers: Number of songs resolved at the same time.
+        """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+
+        self._heap: List[Tuple[int, int, PreloadJob]] = []
+        self._counter = itertools.count()
+        self._jobs: Dict[Song, PreloadJob] = {}
+        self._guild_jobs: Dict[int, Set[Song]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._tasks = []
+
+        metrics.gauge('preload.pending', lambda: len(self._jobs))
+        metrics.gauge('preload.hit_rate', self.hit_rate)
+
+    def _start(self):
+        if self._tasks:
+            return
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    def schedule(self, guild_id: int, songs: Sequence[Song]):
+        """Makes songs the guild's preload jobs, in order of priority. Jobs for other songs are cancelled."""
+        self._start()
+        wanted = set(songs)
+        for song in list(self._guild_jobs.get(guild_id, ())):
+            if song not in wanted and not self._jobs[song].shown:
+                self._cancel_job(self._jobs[song])
+
+        for priority, song in enumerate(songs):
+            if song.base_url is not None:
+                continue
+            job = self._jobs.get(song)
+            if job is None:
+                job = PreloadJob(song, guild_id, priority)
+                self._jobs[song] = job
+                self._guild_jobs.setdefault(guild_id, set()).add(song)
+            elif job.task is not None or job.priority == priority:
+                continue
+            # a re-prioritised job is pushed again, the old heap entry is skipped when popped
+            job.priority = priority
+            heapq.heappush(self._heap, (priority, next(self._counter), job))
+        self._wakeup.set()
+
+    def hydrate(self, guild_id: int, songs: Sequence[Song]):
+        """Resolves songs shown in the queue view without a title, behind the songs about to play"""
+        self._start()
+        for position, song in enumerate(songs):
+            if song.base_url is not None or song in self._jobs:
+                continue
+            priority = config.MAX_SONG_PRELOAD + position
+            job = PreloadJob(song, guild_id, priority)
+            job.shown = True
+            self._jobs[song] = job
+            self._guild_jobs.setdefault(guild_id, set()).add(song)
+            heapq.heappush(self._heap, (priority, next(self._counter), job))
+        self._wakeup.set()
+
+    def cancel(self, guild_id: int):
+        """Cancels every preload job of the guild"""
+        for song in list(self._guild_jobs.get(guild_id, ())):
+            self._cancel_job(self._jobs[song])
+
+    async def claim(self, song: Song):
+        """Called when song starts playing: waits for its running job, or drops its pending one"""
+        if song.base_url is not None:
+            metrics.counter('preload.hit').inc()
+        else:
+            metrics.counter('preload.miss').inc()
+
+        job = self._jobs.get(song)
+        if job is None:
+            return
+        if job.task is None:
+            self._cancel_job(job)
+            return
+        await asyncio.wait({job.task})
+
+    def hit_rate(self) -> float:
+        hit = metrics.counter('preload.hit').value
+        total = hit + metrics.counter('preload.miss').value
+        return hit / total if total else 0.0
+
+    def _cancel_job(self, job: PreloadJob):
+        job.cancelled = True
+        if job.task is not None:
+            job.task.cancel()
+        self._forget(job)
+
+    def _forget(self, job: PreloadJob):
+        if self._jobs.get(job.song) is not job:
+            return
+        del self._jobs[job.song]
+        guild_jobs = self._guild_jobs.get(job.guild_id)
+        if guild_jobs is not None:
+            guild_jobs.discard(job.song)
+            if not guild_jobs:
+                del self._guild_jobs[job.guild_id]
+
+    def _next_job(self) -> Optional[PreloadJob]:
+        while self._heap:
+            priority, _, job = heapq.heappop(self._heap)
+            if job.cancelled or job.task is not None or job.priority != priority:
+                continue
+            return job
+        return None
+
+    async def _work(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            job = self._next_job()
+            if job is None:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            job.task = loop.create_task(utils.preload(job.song, job.guild_id))
+            try:
+                await asyncio.wait({job.task})
+                if not job.task.cancelled() and job.task.exception() is not None:
+                    print(f"Preload failed: {job.task.exception()}")
+            finally:
+                self._forget(job)
+
+
+preloader = PreloadScheduler(config.PRELOAD_WORKERS)
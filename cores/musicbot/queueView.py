@@ -0,0 +1,74 @@
+import discord
+from discord import Interaction
+
+from config import config
+from cores.musicbot.cache import LRUCache
+from cores.musicbot.playlist import Playlist
+from cores.musicbot.preloader import preloader
+
+
+class QueuePages(object):
+    """ Renders the queue one page at a time.
+
+            Rendered pages are cached per queue version, so paging back and forth through an
+            unchanged queue is free. Songs without a title are resolved by the preloader instead
+            of blocking the render, a page is rendered again once one of them got its title.
+        """
+
+    def __init__(self, playlist: Playlist, guild_id: int):
+        self.playlist = playlist
+        self.guild_id = guild_id
+        # (queue version, page) -> (embed, songs it shows without a title)
+        self._pages = LRUCache(config.QUEUE_PAGE_CACHE_SIZE)
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-len(self.playlist) // config.QUEUE_PAGE_SIZE))
+
+    def clamp(self, page: int) -> int:
+        return min(max(page, 0), self.page_count - 1)
+
+    def render(self, page: int) -> discord.Embed:
+        """Returns the embed of the zero-based page"""
+        page = self.clamp(page)
+        key = (self.playlist.version, page)
+        cached = self._pages.get(key)
+        if cached is not None:
+            embed, untitled = cached
+            # only this page is stale once one of its songs got its title
+            if all(song.info.title is None for song in untitled):
+                return embed
+
+        start = page * config.QUEUE_PAGE_SIZE
+        songs = self.playlist.page(start, start + config.QUEUE_PAGE_SIZE)
+
+        embed = discord.Embed(title=f":scroll: Queue [{len(self.playlist)}]", color=config.EMBED_COLOR)
+        for counter, song in enumerate(songs, start=start + 1):
+            if song.info.title is None:
+                embed.add_field(name=f"{counter}.", value=f"[{song.info.webpage_url}]({song.info.webpage_url})", inline=False)
+            else:
+                embed.add_field(name=f"{counter}.", value=f"[{song.info.title}]({song.info.webpage_url})", inline=False)
+        embed.set_footer(text=f"Page {page + 1}/{self.page_count}")
+
+        untitled = [song for song in songs if song.info.title is None]
+        self._pages.put(key, (embed, untitled))
+        if untitled:
+            # shares the preload jobs, a song already being resolved isn't extracted twice
+            preloader.hydrate(self.guild_id, untitled)
+        return embed
+
+class QueueView(discord.ui.View):
+    def __init__(self, pages: QueuePages, page: int):
+        super(QueueView, self).__init__(timeout=config.QUEUE_VIEW_TIMEOUT)
+        self.pages = pages
+        self.page = pages.clamp(page)
+
+    @discord.ui.button(emoji="◀️", style=discord.ButtonStyle.secondary)
+    async def previous_page(self, button: discord.ui.Button, interaction: Interaction):
+        self.page = self.pages.clamp(self.page - 1)
+        await interaction.response.edit_message(embed=self.pages.render(self.page), view=self)
+
+    @discord.ui.button(emoji="▶️", style=discord.ButtonStyle.secondary)
+    async def next_page(self, button: discord.ui.Button, interaction: Interaction):
+        self.page = self.pages.clamp(self.page + 1)
+        await interaction.response.edit_message(embed=self.pages.render(self.page), view=self)
@@ -0,0 +1,62 @@
+import asyncio
+import weakref
+from typing import (
+    List,
+    Optional,
+    TYPE_CHECKING,
+)
+
+from config import config
+from cores import metrics
+from cores.musicbot import utils
+from cores.musicbot.songInfo import Song
+from cores.musicbot.trackCache import stream_expires_within
+
+if TYPE_CHECKING:
+    from cores.musicbot.audioController import AudioController
+
+
+class StreamRevalidator(object):
+    """ Refreshes the stream urls of queued songs shortly before they expire.
+
+            One background task checks the head of every watched queue on an interval and
+            re-extracts the songs whose googlevideo url would expire before they are played.
+        """
+
+    def __init__(self, interval: float, lookahead: int):
+        self.interval = interval
+        self.lookahead = lookahead
+        self._controllers: "weakref.WeakSet[AudioController]" = weakref.WeakSet()
+        self._task: Optional[asyncio.Task] = None
+
+    def watch(self, controller: "AudioController"):
+        self._controllers.add(controller)
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    def _expiring(self, controller: "AudioController") -> List[Song]:
+        # a song is refreshed if its url expires before the next check plus the usual margin
+        horizon = self.interval * 2 + config.STREAM_URL_EXPIRY_MARGIN
+        return [
+            song for song in controller.playlist.page(0, self.lookahead)
+            if song.base_url is not None and stream_expires_within(song.base_url, horizon)
+        ]
+
+    async def _refresh(self, song: Song, guild_id: int):
+        try:
+            await utils.get_song_info(song, guild_id, force=True)
+            metrics.counter('stream.revalidated').inc()
+        except Exception as e:
+            print(f"Could not refresh {song.info.webpage_url}: {e}")
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await asyncio.gather(*(
+                self._refresh(song, controller.guild.id)
+                for controller in list(self._controllers)
+                for song in self._expiring(controller)
+            ))
+
+
+revalidator = StreamRevalidator(config.STREAM_REVALIDATE_INTERVAL, config.MAX_SONG_PRELOAD)
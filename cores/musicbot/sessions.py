@@ -0,0 +1,182 @@
+import asyncio
+from typing import (
+    Any,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+    TYPE_CHECKING,
+)
+
+from config import config
+from cores.classes import DatabaseHandlerBase
+from cores.database import database
+
+if TYPE_CHECKING:
+    from cores.musicbot.audioController import AudioController
+
+
+class SessionData(TypedDict):
+    guild_id: int
+    queue: bytes
+    queue_offset: int
+    current: Optional[bytes]
+    position: int
+    loop: bool
+    volume: int
+
+
+class SessionStore(object):
+    """ Snapshots the playback session of every watched guild to the music_sessions table.
+
+            Changes are coalesced and written on an interval: the packed queue is only
+            rewritten when the queue changed other than by dropping its head, otherwise just
+            the current track, position, loop flag, volume and the number of songs dropped from
+            the head of the saved queue are updated. What was saved is only recorded once the
+            write succeeded, after a failed write the queue is written in full again.
+        """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.db: Optional[MusicSessionDatabaseHandler] = None
+        self._controllers: Dict[int, "AudioController"] = {}
+        self._saved_versions: Dict[int, int] = {}
+        self._saved_pops: Dict[int, int] = {}
+        self._queue_offsets: Dict[int, int] = {}
+        self._saved_states: Dict[int, tuple] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._lock = asyncio.Lock()
+
+    async def load(self, guild_id: int) -> Optional[SessionData]:
+        if self.db is None:
+            return None
+        return await self.db.get_session(guild_id)
+
+    def watch(self, controller: "AudioController", restored: bool = False):
+        """Starts snapshotting the controller, call it once its session was restored"""
+        guild_id = controller.guild.id
+        queue = controller.playlist.play_deque
+        self._controllers[guild_id] = controller
+        # a restored queue no longer lines up with the saved one, it is written in full first
+        self._saved_versions[guild_id] = -1 if restored else queue.version
+        self._saved_pops[guild_id] = queue.popped
+        self._queue_offsets[guild_id] = 0
+        self._saved_states[guild_id] = controller.session_state()
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Could not save music sessions: {e}")
+
+    async def flush(self):
+        if self.db is None:
+            return
+        # the interval and the shutdown flush must not record each other's writes
+        async with self._lock:
+            await self._flush()
+
+    async def _flush(self):
+        snapshots: List[SessionData] = []
+        states: List[Tuple[Any, ...]] = []
+        # (guild_id, version, popped, queue_offset, state) recorded once the write succeeded
+        saved: List[Tuple[int, int, int, int, tuple]] = []
+        for guild_id, controller in self._controllers.items():
+            queue = controller.playlist.play_deque
+            state = controller.session_state()
+            changes = queue.version - self._saved_versions[guild_id]
+            pops = queue.popped - self._saved_pops[guild_id]
+            if changes != pops:
+                snapshots.append(controller.snapshot())
+                queue_offset = 0
+            elif pops or state != self._saved_states[guild_id]:
+                # only songs started since, the saved queue is read from further in
+                queue_offset = self._queue_offsets[guild_id] + pops
+                states.append((guild_id, *state, queue_offset))
+            else:
+                continue
+            saved.append((guild_id, queue.version, queue.popped, queue_offset, state))
+
+        if not saved:
+            return
+        try:
+            await self.db.save_sessions(snapshots, states)
+        except Exception:
+            # the saved rows are unknown now, an offset must not be applied to an outdated queue
+            for guild_id, *_ in saved:
+                self._saved_versions[guild_id] = -1
+            raise
+
+        for guild_id, version, popped, queue_offset, state in saved:
+            self._saved_versions[guild_id] = version
+            self._saved_pops[guild_id] = popped
+            self._queue_offsets[guild_id] = queue_offset
+            self._saved_states[guild_id] = state
+
+
+class MusicSessionDatabaseHandler(DatabaseHandlerBase):
+    def __init__(self):
+        super(MusicSessionDatabaseHandler, self).__init__()
+
+    async def save_sessions(self, snapshots: List[SessionData], states: List[Tuple[Any, ...]]):
+        """
+        Writes full snapshots and state-only updates in one transaction
+        :param snapshots: List[SessionData] sessions whose queue changed
+        :param states: List[Tuple] (guild_id, current, position, loop, volume, queue_offset) of the others
+        :return:
+        """
+        async with self.db.transaction('music_sessions.save') as conn:
+            if snapshots:
+                await conn.executemany(
+                    """
+                    INSERT INTO music_sessions (guild_id, queue, queue_offset, current, position, loop, volume)
+                    VALUES ($1, $2, $3, $4, $5, $6, $7)
+                    ON CONFLICT (guild_id) DO UPDATE
+                    SET queue = excluded.queue,
+                        queue_offset = excluded.queue_offset,
+                        current = excluded.current,
+                        position = excluded.position,
+                        loop = excluded.loop,
+                        volume = excluded.volume,
+                        updated_at = now();""",
+                    [(
+                        s['guild_id'], s['queue'], s['queue_offset'],
+                        s['current'], s['position'], s['loop'], s['volume']
+                    ) for s in snapshots]
+                )
+            if states:
+                await conn.executemany(
+                    """
+                    UPDATE music_sessions
+                    SET current = $2, position = $3, loop = $4, volume = $5, queue_offset = $6,
+                        updated_at = now()
+                    WHERE guild_id = $1;""",
+                    states
+                )
+
+    async def get_session(self, guild_id: int) -> Optional[SessionData]:
+        s = await self.db.fetchrow('music_sessions.get', """
+            SELECT guild_id, queue, queue_offset, current, position, loop, volume
+            FROM music_sessions
+            WHERE guild_id = $1;
+        """, guild_id)
+        if s is None:
+            return None
+        return SessionData(
+            guild_id=s['guild_id'],
+            queue=s['queue'],
+            queue_offset=s['queue_offset'],
+            current=s['current'],
+            position=s['position'],
+            loop=s['loop'],
+            volume=s['volume']
+        )
+
+
+session_store = SessionStore(config.SESSION_FLUSH_INTERVAL)
+database.on_close(session_store.flush)
@@ -1,6 +1,7 @@
+import asyncio
 import os
 from typing import (
-    Any,
+    Dict,
     List,
     Literal,
     NoReturn,
@@ -17,6 +18,7 @@ from config import config
 from cores.classes import (
     DatabaseHandlerBase,
 )
+from cores.database import database
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
 
@@ -63,6 +65,9 @@ class Settings(object):
             await self.process_setting(setting, value)
         except ValueError as e:
             raise e
+        finally:
+            # some setters change the config before failing
+            settings_writer.mark_dirty(self.config)
 
     def upgrade(self):
         keys: List[SettingsFields] = list(SettingsFields)
@@ -229,70 +234,134 @@ class Settings(object):
         ))
 
 
+class SettingsWriter(object):
+    """ Write-behind persistence of guild settings.
+
+            Changed settings are only marked dirty, repeated changes of a guild are coalesced
+            into one row and written with the other dirty guilds in one upsert on an interval.
+            Reads never touch the database, Settings keeps serving its in-memory config.
+        """
+
+    def __init__(self, interval: float):
+        self.interval = interval
+        self.db: Optional[MusicSettingsDatabaseHandler] = None
+        self._dirty: Dict[int, SettingsData] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def mark_dirty(self, settings: SettingsData):
+        self._dirty[settings['guild_id']] = settings
+        if self._task is None:
+            self._task = asyncio.get_event_loop().create_task(self._run())
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.flush()
+
+    def _take_dirty(self) -> List[SettingsData]:
+        dirty, self._dirty = self._dirty, {}
+        # copies, so changes made during the write mark the guild dirty again instead of being half written
+        return [SettingsData(**settings) for settings in dirty.values()]
+
+    def _restore_dirty(self, settings_list: List[SettingsData]):
+        for settings in settings_list:
+            self._dirty.setdefault(settings['guild_id'], settings)
+
+    async def flush(self):
+        if self.db is None or not self._dirty:
+            return
+        settings_list = self._take_dirty()
+        try:
+            await self.db.save_many_settings(settings_list)
+        except Exception as e:
+            print(f"Could not save settings: {e}")
+            self._restore_dirty(settings_list)
+
+
+def _to_settings_data(s) -> SettingsData:
+    return SettingsData(
+        guild_id=s['guild_id'],
+        default_nickname=s['default_nickname'],
+        command_channel=s['command_channel'],
+        start_voice_channel=s['start_voice_channel'],
+        user_must_be_in_vc=s['user_must_be_in_vc'],
+        button_emote=s['button_emote'],
+        default_volume=s['default_volume'],
+        vc_timeout=s['vc_timeout']
+    )
+
+
 class MusicSettingsDatabaseHandler(DatabaseHandlerBase):
-    _table_name = 'music_settings'
-    _create_table_sql = """
-        CREATE TABLE music_settings (
-            guild_id bigint PRIMARY KEY ,
-            default_nickname char(32) not null,
-            command_channel  int null,
-            start_voice_channel int null,
-            user_must_be_in_vc bool not null,
-            button_emote char(32) not null,
-            default_volume smallint not null,
-            vc_timeout bool not null
-        );"""
-
-    def __init__(self, dsn: Any):
-        super(MusicSettingsDatabaseHandler, self).__init__(dsn)
-
-    def save_settings(self, settings: SettingsData):
-        with self.conn:
-            with self.conn.cursor() as cur:
-                sql = """
-                    INSERT INTO music_settings
-                    (guild_id, default_nickname, command_channel, start_voice_channel,
-                    user_must_be_in_vc, button_emote, default_volume, vc_timeout)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-                    ON CONFLICT (guild_id) DO UPDATE
-                    SET default_nickname = excluded.default_nickname,
-                        command_channel = excluded.command_channel,
-                        start_voice_channel = excluded.start_voice_channel,
-                        user_must_be_in_vc = excluded.user_must_be_in_vc,
-                        button_emote = excluded.button_emote,
-                        default_volume = excluded.default_volume,
-                        vc_timeout = excluded.vc_timeout;"""
-                cur.execute(
-                    sql, (
-                        settings['guild_id'],
-                        settings['default_nickname'],
-                        settings['command_channel'],
-                        settings['start_voice_channel'],
-                        settings['user_must_be_in_vc'],
-                        settings['button_emote'],
-                        settings['default_volume'],
-                        settings['vc_timeout'],
-                    )
-                )
-
-    def get_settings(self, guild_id: int) -> Optional[SettingsData]:
-        with self.conn.cursor() as cur:
-            cur.execute("""
+    def __init__(self):
+        super(MusicSettingsDatabaseHandler, self).__init__()
+
+    async def save_settings(self, settings: SettingsData):
+        await self.save_many_settings([settings])
+
+    async def save_many_settings(self, settings_list: List[SettingsData]):
+        """Upserts the settings of many guilds in one pipelined batch"""
+        sql = """
+            INSERT INTO music_settings
+            (guild_id, default_nickname, command_channel, start_voice_channel,
+            user_must_be_in_vc, button_emote, default_volume, vc_timeout)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            ON CONFLICT (guild_id) DO UPDATE
+            SET default_nickname = excluded.default_nickname,
+                command_channel = excluded.command_channel,
+                start_voice_channel = excluded.start_voice_channel,
+                user_must_be_in_vc = excluded.user_must_be_in_vc,
+                button_emote = excluded.button_emote,
+                default_volume = excluded.default_volume,
+                vc_timeout = excluded.vc_timeout;"""
+        await self.db.executemany('music_settings.save', sql, [(
+            settings['guild_id'],
+            settings['default_nickname'],
+            settings['command_channel'],
+            settings['start_voice_channel'],
+            settings['user_must_be_in_vc'],
+            settings['button_emote'],
+            settings['default_volume'],
+            settings['vc_timeout'],
+        ) for settings in settings_list])
+
+    async def insert_default_settings(self, settings_list: List[SettingsData]):
+        """Inserts default settings of guilds without a row, stored settings are left as they are"""
+        sql = """
+            INSERT INTO music_settings
+            (guild_id, default_nickname, command_channel, start_voice_channel,
+            user_must_be_in_vc, button_emote, default_volume, vc_timeout)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            ON CONFLICT (guild_id) DO NOTHING;"""
+        await self.db.executemany('music_settings.insert_default', sql, [(
+            settings['guild_id'],
+            settings['default_nickname'],
+            settings['command_channel'],
+            settings['start_voice_channel'],
+            settings['user_must_be_in_vc'],
+            settings['button_emote'],
+            settings['default_volume'],
+            settings['vc_timeout'],
+        ) for settings in settings_list])
+
+    async def get_settings(self, guild_id: int) -> Optional[SettingsData]:
+        s = await self.db.fetchrow('music_settings.get', """
             SELECT guild_id, default_nickname, command_channel, start_voice_channel,
                     user_must_be_in_vc, button_emote, default_volume, vc_timeout
             FROM music_settings
-            WHERE guild_id = %s;
-        """, (guild_id,))
-            s = cur.fetchone()
-            if s is None:
-                return None
-            return SettingsData(
-                guild_id=s[0],
-                default_nickname=s[1],
-                command_channel=s[2],
-                start_voice_channel=s[3],
-                user_must_be_in_vc=s[4],
-                button_emote=s[5],
-                default_volume=s[6],
-                vc_timeout=s[7]
-            )
+            WHERE guild_id = $1;
+        """, guild_id)
+        if s is None:
+            return None
+        return _to_settings_data(s)
+
+    async def get_all_settings(self) -> Dict[int, SettingsData]:
+        rows = await self.db.fetch('music_settings.list', """
+            SELECT guild_id, default_nickname, command_channel, start_voice_channel,
+                    user_must_be_in_vc, button_emote, default_volume, vc_timeout
+            FROM music_settings;
+        """)
+        return {s['guild_id']: _to_settings_data(s) for s in rows}
+
+
+settings_writer = SettingsWriter(config.SETTINGS_FLUSH_INTERVAL)
+database.on_close(settings_writer.flush)
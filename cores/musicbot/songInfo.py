@@ -1,25 +1,142 @@
 import datetime
+import struct
+import sys
+from typing import (
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
 
 import discord
 
 from config import config
+from cores.musicbot import linkutils
+
+# persisted by index, only ever append to these
+_SITES = tuple(linkutils.Sites)
+_ORIGINS = tuple(linkutils.Origins)
+
+_HEADER = struct.Struct('<BBBi')  # flags, host, origin, duration (-1 if unknown)
+_STRING_LENGTH = struct.Struct('<H')
+_RECORD_LENGTH = struct.Struct('<I')
+_FLAG_VIDEO_ID = 1
+
+
+def _youtube_thumbnail_prefix(video_id: str) -> str:
+    return f"https://i.ytimg.com/vi/{video_id}/"
+
+
+def _pack_string(value: Optional[str]) -> bytes:
+    if value is None:
+        return _STRING_LENGTH.pack(0xFFFF)
+    data = value.encode('utf-8')[:0xFFFE]
+    return _STRING_LENGTH.pack(len(data)) + data
+
+
+def _unpack_string(data: bytes, offset: int) -> Tuple[Optional[str], int]:
+    (length,) = _STRING_LENGTH.unpack_from(data, offset)
+    offset += _STRING_LENGTH.size
+    if length == 0xFFFF:
+        return None, offset
+    return data[offset:offset + length].decode('utf-8', errors='replace'), offset + length
 
 
 class Song(object):
+    __slots__ = ('host', 'origin', 'base_url', 'info')
+
     def __init__(self, origin, host, base_url=None, uploader=None, title=None, duration=None, webpage_url=None, thumbnail=None):
         self.host = host
         self.origin = origin
         self.base_url = base_url
         self.info = self.Sinfo(uploader, title, duration, webpage_url, thumbnail)
 
+    def to_bytes(self) -> bytes:
+        """Packs the song without its stream url, which expires anyway"""
+        info = self.info
+        video_id = info.video_id
+        flags = _FLAG_VIDEO_ID if video_id is not None else 0
+        return b"".join((
+            _HEADER.pack(
+                flags,
+                _SITES.index(self.host),
+                _ORIGINS.index(self.origin),
+                info.duration if info.duration is not None else -1
+            ),
+            _pack_string(video_id if video_id is not None else info.webpage_url),
+            _pack_string(info.title),
+            _pack_string(info.uploader),
+            _pack_string(info._thumbnail),
+        ))
+
+    @classmethod
+    def from_bytes(cls, data: bytes, offset: int = 0) -> "Song":
+        flags, host, origin, duration = _HEADER.unpack_from(data, offset)
+        offset += _HEADER.size
+        url, offset = _unpack_string(data, offset)
+        title, offset = _unpack_string(data, offset)
+        uploader, offset = _unpack_string(data, offset)
+        thumbnail, offset = _unpack_string(data, offset)
+
+        song = cls(_ORIGINS[origin], _SITES[host], uploader=uploader, title=title,
+                   duration=duration if duration >= 0 else None)
+        if flags & _FLAG_VIDEO_ID:
+            song.info.video_id = url
+        else:
+            song.info.webpage_url = url
+        song.info._thumbnail = thumbnail
+        return song
+
     class Sinfo:
+        __slots__ = ('_uploader', 'title', 'duration', 'video_id', '_url', '_thumbnail')
+
         def __init__(self, uploader, title, duration, webpage_url, thumbnail):
             self.uploader = uploader
             self.title = title
-            self.duration = duration
+            self.duration = int(duration) if duration is not None else None
+            self.video_id: Optional[str] = None
+            self._url: Optional[str] = None
+            self._thumbnail: Optional[str] = None
             self.webpage_url = webpage_url
             self.thumbnail = thumbnail
-            self.output = ""
+
+        @property
+        def uploader(self) -> Optional[str]:
+            return self._uploader
+
+        @uploader.setter
+        def uploader(self, value: Optional[str]):
+            # uploaders repeat across imported playlists, share one string per name
+            self._uploader = sys.intern(value) if value is not None else None
+
+        @property
+        def webpage_url(self) -> Optional[str]:
+            if self.video_id is not None:
+                return f"https://www.youtube.com/watch?v={self.video_id}"
+            return self._url
+
+        @webpage_url.setter
+        def webpage_url(self, value: Optional[str]):
+            # YouTube links are stored as their video id and rebuilt on demand
+            video_id = None
+            if linkutils.identify_url(value) == linkutils.Sites.YouTube:
+                video_id = linkutils.get_video_id(value)
+            self.video_id = video_id
+            self._url = value if video_id is None else None
+
+        @property
+        def thumbnail(self) -> Optional[str]:
+            if self.video_id is not None and self._thumbnail is not None and "://" not in self._thumbnail:
+                return _youtube_thumbnail_prefix(self.video_id) + self._thumbnail
+            return self._thumbnail
+
+        @thumbnail.setter
+        def thumbnail(self, value: Optional[str]):
+            if value is not None and self.video_id is not None:
+                prefix = _youtube_thumbnail_prefix(self.video_id)
+                if value.startswith(prefix):
+                    value = value[len(prefix):]
+            self._thumbnail = value
 
         def format_output(self, play_type):
             embed = discord.Embed(title=play_type, description=f"[{self.title}]({self.webpage_url})", color=config.EMBED_COLOR)
@@ -37,3 +154,29 @@ class Song(object):
                                 value=config.SONGINFO_UNKNOWN_DURATION, inline=False)
 
             return embed
+
+
+def pack_songs(songs: Iterable[Song]) -> bytes:
+    """Packs songs into length-prefixed records"""
+    records = []
+    for song in songs:
+        record = song.to_bytes()
+        records.append(_RECORD_LENGTH.pack(len(record)))
+        records.append(record)
+    return b"".join(records)
+
+
+def unpack_songs(data: bytes, skip: int = 0) -> List[Song]:
+    """Unpacks the songs after the first `skip` records, which are stepped over without decoding"""
+    songs = []
+    offset = 0
+    while skip > 0 and offset < len(data):
+        (length,) = _RECORD_LENGTH.unpack_from(data, offset)
+        offset += _RECORD_LENGTH.size + length
+        skip -= 1
+    while offset < len(data):
+        (length,) = _RECORD_LENGTH.unpack_from(data, offset)
+        offset += _RECORD_LENGTH.size
+        songs.append(Song.from_bytes(data, offset))
+        offset += length
+    return songs
@@ -0,0 +1,134 @@
+import time
+from typing import (
+    Callable,
+    Optional,
+)
+
+import numpy as np
+from discord import (
+    AudioSource,
+    ClientException,
+    FFmpegOpusAudio,
+    FFmpegPCMAudio,
+)
+
+from config import config
+
+FFMPEG_BEFORE_OPTIONS = '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5'
+FRAME_SECONDS = 0.02  # every read returns 20ms of audio
+
+
+def ffmpeg_source(location: str, before_options: Optional[str] = None, passthrough: bool = False) -> AudioSource:
+    """Opens an Opus input as Opus packets copied as-is, or anything as PCM"""
+    if passthrough:
+        return FFmpegOpusAudio(location, codec='opus', before_options=before_options)
+    return FFmpegPCMAudio(location, before_options=before_options)
+
+
+class PrimedAudio(AudioSource):
+    """ Wraps an audio source whose first frame can be read ahead of playback.
+
+            Priming spawns and connects FFmpeg before the source is handed to the voice client,
+            so starting playback is a plain source swap.
+
+            Attributes:
+                source: The wrapped audio source.
+                on_start: Called from the player thread when the first frame is played.
+                offset: Seconds into the track the source starts at.
+                frames: Number of frames handed to the player so far.
+                normalization: Loudness normalization gain the source was opened for.
+        """
+
+    def __init__(self, source: AudioSource, offset: int = 0, normalization: float = 1.0):
+        self.source = source
+        self.on_start: Optional[Callable[[], None]] = None
+        self.started_at: Optional[float] = None
+        self.offset = offset
+        self.frames = 0
+        self.normalization = normalization
+        self._first_frame: Optional[bytes] = None
+
+    @property
+    def position(self) -> float:
+        """Seconds into the track that were played"""
+        return self.offset + self.frames * FRAME_SECONDS
+
+    def prime(self) -> bool:
+        """Blocks until the first frame is available, returns whether the stream produced audio"""
+        if self._first_frame is None:
+            self._first_frame = self.source.read()
+        return bool(self._first_frame)
+
+    def read(self) -> bytes:
+        if self._first_frame is not None:
+            frame, self._first_frame = self._first_frame, None
+        else:
+            frame = self.source.read()
+        self.frames += 1
+
+        if self.started_at is None:
+            self.started_at = time.perf_counter()
+            if self.on_start is not None:
+                self.on_start()
+        return frame
+
+    def is_opus(self) -> bool:
+        return self.source.is_opus()
+
+    def cleanup(self):
+        self.source.cleanup()
+
+
+class GainTransformer(AudioSource):
+    """ Scales 16-bit stereo PCM by the volume times the loudness normalization gain.
+
+            Frames are scaled as NumPy views of the read buffer. A volume change only sets the
+            target gain, the next frames ramp towards it so the change doesn't click.
+
+            Attributes:
+                source: The wrapped PCM source.
+                normalization: Gain bringing the track to the target loudness.
+        """
+
+    def __init__(self, source: AudioSource, volume: float = 1.0, normalization: float = 1.0):
+        if source.is_opus():
+            raise ClientException('AudioSource must not be Opus encoded.')
+
+        self.source = source
+        self.normalization = normalization
+        self._volume = volume
+        self._gain = volume * normalization
+        self._ramp_frames = 0
+
+    @property
+    def volume(self) -> float:
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = max(value, 0.0)
+        self._ramp_frames = config.GAIN_RAMP_FRAMES
+
+    def read(self) -> bytes:
+        frame = self.source.read()
+        target = self._volume * self.normalization
+        if not frame or (self._gain == 1.0 and target == 1.0):
+            return frame
+
+        samples = np.frombuffer(frame, dtype=np.int16)
+        if self._ramp_frames > 0:
+            gain = self._gain + (target - self._gain) / self._ramp_frames
+            # one gain per stereo sample pair, moving linearly across the frame
+            gains = np.linspace(self._gain, gain, samples.size // 2, dtype=np.float32).repeat(2)
+            self._gain = gain
+            self._ramp_frames -= 1
+        else:
+            gains = np.float32(target)
+            self._gain = target
+
+        scaled = samples * gains
+        np.clip(scaled, -32768, 32767, out=scaled)
+        return scaled.astype(np.int16).tobytes()
+
+    def cleanup(self):
+        self.source.cleanup()
@@ -0,0 +1,165 @@
+import re
+from typing import (
+    AsyncIterator,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+)
+
+import spotipy
+from spotipy.oauth2 import SpotifyClientCredentials
+
+from config import config
+from cores import metrics
+from cores.classes import DatabaseHandlerBase
+from cores.musicbot import (
+    linkutils,
+    utils,
+)
+from cores.musicbot.cache import LRUCache
+from cores.musicbot.extractor import extractor
+
+spotify_collection_regex = re.compile(r"open\.spotify\.com/(?:intl-[\w-]+/)?(playlist|album)/([0-9A-Za-z]+)")
+
+PLAYLIST_PAGE_SIZE = 100
+ALBUM_PAGE_SIZE = 50
+TRACKS_BATCH_SIZE = 50
+
+
+class SpotifyTrack(TypedDict):
+    id: Optional[str]
+    isrc: Optional[str]
+    title: str
+    duration: Optional[int]
+
+
+def _to_spotify_track(t: dict) -> SpotifyTrack:
+    artists = ", ".join(a['name'] for a in t.get('artists') or ())
+    duration = t.get('duration_ms')
+    return SpotifyTrack(
+        id=t.get('id'),
+        isrc=(t.get('external_ids') or {}).get('isrc'),
+        title=f"{artists} - {t['name']}" if artists else t['name'],
+        duration=duration // 1000 if duration is not None else None,
+    )
+
+
+def _match_keys(track: SpotifyTrack) -> List[str]:
+    keys = []
+    if track['isrc'] is not None:
+        keys.append(f"isrc:{track['isrc']}")
+    keys.append(f"title:{utils.normalize_query(track['title'])}")
+    return keys
+
+
+class SpotifyImporter(object):
+    """ Imports Spotify playlists and albums through the Web API and matches their tracks to YouTube.
+
+            Track lists are fetched in paged bulk calls. Matches are kept in an ISRC/title -> video id
+            cache, backed by the spotify_match table.
+        """
+
+    def __init__(self, client_id: str, client_secret: str):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self._client: Optional[spotipy.Spotify] = None
+        self._matches = LRUCache(config.SPOTIFY_MATCH_CACHE_SIZE)
+        self.db: Optional[SpotifyMatchDatabaseHandler] = None
+
+    @property
+    def client(self) -> spotipy.Spotify:
+        if self._client is None:
+            if not self.client_id or not self.client_secret:
+                raise ValueError("Spotify credentials are not configured")
+            self._client = spotipy.Spotify(auth_manager=SpotifyClientCredentials(
+                client_id=self.client_id,
+                client_secret=self.client_secret
+            ))
+        return self._client
+
+    def _fetch_page(self, kind: str, collection_id: str, offset: int) -> Tuple[List[SpotifyTrack], bool]:
+        if kind == 'playlist':
+            page = self.client.playlist_items(
+                collection_id, limit=PLAYLIST_PAGE_SIZE, offset=offset, additional_types=('track',)
+            )
+            items = [i['track'] for i in page['items'] if i.get('track') and i['track'].get('name')]
+        else:
+            page = self.client.album_tracks(collection_id, limit=ALBUM_PAGE_SIZE, offset=offset)
+            # album tracks are simplified objects without an ISRC, fetch the full tracks in bulk
+            ids = [i['id'] for i in page['items'] if i.get('id')]
+            items = []
+            for start in range(0, len(ids), TRACKS_BATCH_SIZE):
+                items.extend(t for t in self.client.tracks(ids[start:start + TRACKS_BATCH_SIZE])['tracks'] if t)
+        return [_to_spotify_track(t) for t in items], page['next'] is not None
+
+    async def iter_tracks(self, url: str, guild_id: int = 0) -> AsyncIterator[SpotifyTrack]:
+        """Yields the tracks of a Spotify playlist or album page by page"""
+        result = spotify_collection_regex.search(url)
+        if result is None:
+            raise ValueError(f"Not a Spotify playlist or album: {url}")
+        kind, collection_id = result.groups()
+
+        offset = 0
+        has_next = True
+        while has_next:
+            tracks, has_next = await extractor.run(
+                self._fetch_page, kind, collection_id, offset, guild_id=guild_id, in_thread=True
+            )
+            offset += PLAYLIST_PAGE_SIZE if kind == 'playlist' else ALBUM_PAGE_SIZE
+            for track in tracks:
+                yield track
+
+    async def _get_match(self, key: str) -> Optional[str]:
+        video_id = self._matches.get(key)
+        if video_id is None and self.db is not None:
+            video_id = await self.db.get_match(key)
+            if video_id is not None:
+                self._matches.put(key, video_id)
+        return video_id
+
+    async def _save_match(self, keys: List[str], video_id: str):
+        for key in keys:
+            self._matches.put(key, video_id)
+        if self.db is not None:
+            await self.db.save_matches(keys, video_id)
+
+    async def resolve(self, track: SpotifyTrack, guild_id: int = 0) -> Optional[str]:
+        """Returns the YouTube link matching the track"""
+        keys = _match_keys(track)
+        for key in keys:
+            if (video_id := await self._get_match(key)) is not None:
+                metrics.counter('spotify_match.hit').inc()
+                return f"https://www.youtube.com/watch?v={video_id}"
+        metrics.counter('spotify_match.miss').inc()
+
+        link = await utils.search_youtube(track['title'], guild_id)
+        video_id = linkutils.get_video_id(link)
+        if video_id is None:
+            return None
+        await self._save_match(keys, video_id)
+        return link
+
+
+class SpotifyMatchDatabaseHandler(DatabaseHandlerBase):
+    def __init__(self):
+        super(SpotifyMatchDatabaseHandler, self).__init__()
+
+    async def save_matches(self, match_keys: List[str], video_id: str):
+        await self.db.executemany(
+            'spotify_match.save',
+            """
+            INSERT INTO spotify_match (match_key, video_id) VALUES ($1, $2)
+            ON CONFLICT (match_key) DO UPDATE SET video_id = excluded.video_id;""",
+            [(key, video_id) for key in match_keys]
+        )
+
+    async def get_match(self, match_key: str) -> Optional[str]:
+        return await self.db.fetchval(
+            'spotify_match.get',
+            "SELECT video_id FROM spotify_match WHERE match_key = $1;",
+            match_key
+        )
+
+
+spotify_importer = SpotifyImporter(config.SPOTIFY_ID, config.SPOTIFY_SECRET)
@@ -0,0 +1,164 @@
+import re
+import time
+from typing import (
+    Optional,
+    TypedDict,
+)
+
+from config import config
+from cores import metrics
+from cores.classes import DatabaseHandlerBase
+from cores.musicbot import linkutils
+from cores.musicbot.cache import LRUCache
+
+expire_regex = re.compile(r"[?&/]expire[=/](\d+)")
+mime_regex = re.compile(r"[?&/]mime[=/]audio(?:%2F|/)(\w+)")
+
+
+class TrackData(TypedDict):
+    track_key: str
+    title: Optional[str]
+    uploader: Optional[str]
+    duration: Optional[int]
+    webpage_url: str
+    thumbnail: Optional[str]
+    stream_url: Optional[str]
+    stream_expire: Optional[int]
+
+
+def get_track_key(url: str) -> str:
+    """Canonical cache key of a track: the video id for YouTube, the url otherwise"""
+    return linkutils.get_video_id(url) or url
+
+
+def get_stream_expire(stream_url: Optional[str]) -> Optional[int]:
+    """Reads the unix timestamp in the `expire=` parameter of a googlevideo stream url"""
+    if stream_url is None:
+        return None
+    if result := expire_regex.search(stream_url):
+        return int(result.group(1))
+    return None
+
+
+def stream_is_opus(stream_url: Optional[str]) -> bool:
+    """Whether a googlevideo stream url serves WebM audio, which YouTube only encodes as Opus"""
+    if stream_url is None:
+        return False
+    result = mime_regex.search(stream_url)
+    return result is not None and result.group(1) == 'webm'
+
+
+def stream_is_valid(data: TrackData) -> bool:
+    expire = data['stream_expire']
+    if data['stream_url'] is None or expire is None:
+        return False
+    return expire - config.STREAM_URL_EXPIRY_MARGIN > time.time()
+
+
+def stream_expires_within(stream_url: Optional[str], seconds: float) -> bool:
+    """Whether the stream url expires in the next seconds, urls without an expiry never do"""
+    expire = get_stream_expire(stream_url)
+    return expire is not None and expire - seconds <= time.time()
+
+
+def track_data_from_info(r: dict) -> TrackData:
+    """Builds the cache record from a yt_dlp info dict"""
+    if r.get('thumbnails'):
+        thumbnail = r.get('thumbnails')[-1]['url']
+    else:
+        thumbnail = None
+    duration = r.get('duration')
+
+    return TrackData(
+        track_key=get_track_key(r.get('webpage_url')),
+        title=r.get('title'),
+        uploader=r.get('uploader'),
+        duration=int(duration) if duration is not None else None,
+        webpage_url=r.get('webpage_url'),
+        thumbnail=thumbnail,
+        stream_url=r.get('url'),
+        stream_expire=get_stream_expire(r.get('url')),
+    )
+
+
+class TrackCache(object):
+    """ Two-tier cache of resolved tracks: an in-memory LRU in front of the track_cache table.
+
+            Static metadata is kept indefinitely, stream urls only until their `expire=` timestamp.
+        """
+
+    def __init__(self, maxsize: int):
+        self._memory = LRUCache(maxsize)
+        self.db: Optional[TrackCacheDatabaseHandler] = None
+
+    async def get(self, url: str) -> Optional[TrackData]:
+        key = get_track_key(url)
+        data = self._memory.get(key)
+        if data is None and self.db is not None:
+            data = await self.db.get_track(key)
+            if data is not None:
+                self._memory.put(key, data)
+
+        if data is None:
+            metrics.counter('track_cache.miss').inc()
+        else:
+            metrics.counter('track_cache.hit').inc()
+        return data
+
+    async def put(self, data: TrackData):
+        self._memory.put(data['track_key'], data)
+        if self.db is not None:
+            await self.db.save_track(data)
+
+
+class TrackCacheDatabaseHandler(DatabaseHandlerBase):
+    def __init__(self):
+        super(TrackCacheDatabaseHandler, self).__init__()
+
+    async def save_track(self, data: TrackData):
+        sql = """
+            INSERT INTO track_cache
+            (track_key, title, uploader, duration, webpage_url, thumbnail, stream_url, stream_expire)
+            VALUES ($1, $2, $3, $4, $5, $6, $7, $8)
+            ON CONFLICT (track_key) DO UPDATE
+            SET title = excluded.title,
+                uploader = excluded.uploader,
+                duration = excluded.duration,
+                webpage_url = excluded.webpage_url,
+                thumbnail = excluded.thumbnail,
+                stream_url = excluded.stream_url,
+                stream_expire = excluded.stream_expire;"""
+        await self.db.execute(
+            'track_cache.save',
+            sql,
+            data['track_key'],
+            data['title'],
+            data['uploader'],
+            data['duration'],
+            data['webpage_url'],
+            data['thumbnail'],
+            data['stream_url'],
+            data['stream_expire'],
+        )
+
+    async def get_track(self, track_key: str) -> Optional[TrackData]:
+        t = await self.db.fetchrow('track_cache.get', """
+            SELECT track_key, title, uploader, duration, webpage_url, thumbnail, stream_url, stream_expire
+            FROM track_cache
+            WHERE track_key = $1;
+        """, track_key)
+        if t is None:
+            return None
+        return TrackData(
+            track_key=t[0],
+            title=t[1],
+            uploader=t[2],
+            duration=t[3],
+            webpage_url=t[4],
+            thumbnail=t[5],
+            stream_url=t[6],
+            stream_expire=t[7]
+        )
+
+
+track_cache = TrackCache(config.TRACK_CACHE_SIZE)
@@ -1,13 +1,9 @@
-import asyncio
-import concurrent.futures
 from typing import (
-    Callable,
     List,
     NoReturn,
     Optional,
 )
 
-import yt_dlp
 from discord import (
     Guild,
     VoiceProtocol,
@@ -19,9 +15,25 @@ from discord.ext.commands import (
 from yarl import URL
 
 from config import config
+from cores import metrics
 from cores.musicbot import linkutils
+from cores.musicbot.cache import LRUCache
+from cores.musicbot.extractor import (
+    extractor,
+    PLAYLIST_OPTIONS,
+    SEARCH_OPTIONS,
+    SONG_OPTIONS,
+)
 from cores.musicbot.settings import Settings
 from cores.musicbot.songInfo import Song
+from cores.musicbot.trackCache import (
+    stream_is_valid,
+    track_cache,
+    track_data_from_info,
+    TrackData,
+)
+
+search_cache = LRUCache(config.SEARCH_CACHE_SIZE, ttl=config.SEARCH_CACHE_TTL)
 
 
 def get_guild(ctx: Context) -> Optional[Guild]:
@@ -65,102 +77,90 @@ async def playable(ctx: Context, guild: Guild, settings: Settings) -> bool:
     return True
 
 
-def play_list(url: URL) -> List[Song]:
-    options = {
-        'format': 'bestaudio/best',
-        'extract_flat': True,
-        "cookiefile": config.COOKIE_PATH
-    }
+async def play_list(url: URL, guild_id: int = 0) -> List[Song]:
     song_list = []
-    with yt_dlp.YoutubeDL(options) as ydl:
-        r = ydl.extract_info(url, download=False)
+    r = await extractor.extract_info(str(url), PLAYLIST_OPTIONS, guild_id)
 
-        for entry in r['entries']:
-            link = f"https://www.youtube.com/watch?v={entry['id']}"
+    for entry in r['entries']:
+        link = f"https://www.youtube.com/watch?v={entry['id']}"
 
-            song = Song(
-                linkutils.Origins.Playlist,
-                linkutils.Sites.YouTube,
-                webpage_url=link
-            )
+        song = Song(
+            linkutils.Origins.Playlist,
+            linkutils.Sites.YouTube,
+            webpage_url=link
+        )
 
-            song_list.append(song)
+        song_list.append(song)
     return song_list
 
 
-def get_song_info(song: Song) -> NoReturn:
-    options = {
-        'format': 'bestaudio',
-        'title': True,
-        "cookiefile": config.COOKIE_PATH
-    }
-    with yt_dlp.YoutubeDL(options) as ydl:
-        r = ydl.extract_info(song.info.webpage_url, download=False)
-        song.base_url = r.get('url')
-        song.info.uploader = r.get('uploader')
-        song.info.title = r.get('title')
-        song.info.duration = r.get('duration')
-        song.info.webpage_url = r.get('webpage_url')
-        song.info.thumbnail = r.get('thumbnails')[0]['url']
+async def resolve_track(url: str, guild_id: int = 0, force: bool = False) -> TrackData:
+    """Returns the track data of url, only extracting on a cache miss, an expired stream url or if forced"""
+    if not force:
+        data = await track_cache.get(url)
+        if data is not None and stream_is_valid(data):
+            return data
+
+    r = await extractor.extract_info(url, SONG_OPTIONS, guild_id)
+    data = track_data_from_info(r)
+    await track_cache.put(data)
+    return data
+
 
+async def get_song_info(song: Song, guild_id: int = 0, force: bool = False) -> NoReturn:
+    data = await resolve_track(song.info.webpage_url, guild_id, force)
+    song.base_url = data['stream_url']
+    song.info.uploader = data['uploader']
+    song.info.title = data['title']
+    song.info.duration = data['duration']
+    song.info.webpage_url = data['webpage_url']
+    song.info.thumbnail = data['thumbnail']
 
-def search_youtube(title: str) -> Optional[str]:
+
+def normalize_query(query: str) -> str:
+    return " ".join(query.casefold().split())
+
+
+async def search_youtube(title: str, guild_id: int = 0) -> Optional[str]:
     """Searches YouTube for the video title and returns the first results video link"""
 
     # if title is already a link
     if linkutils.get_url(title) is not None:
         return title
 
-    options = {
-        'format': 'bestaudio/best',
-        'default_search': 'auto',
-        'noplaylist': True,
-        "cookiefile": config.COOKIE_PATH
-    }
+    query = normalize_query(title)
+    if query in search_cache:
+        metrics.counter('search_cache.hit').inc()
+        return search_cache.get(query)
+    metrics.counter('search_cache.miss').inc()
 
-    with yt_dlp.YoutubeDL(options) as ydl:
-        r = ydl.extract_info(title, download=False)
+    r = await extractor.extract_info(f"ytsearch1:{title}", SEARCH_OPTIONS, guild_id)
 
-    if r is None:
+    if r is None or not r.get('entries'):
+        search_cache.put(query, None, ttl=config.SEARCH_CACHE_NEGATIVE_TTL)
         return None
 
     video_code = r['entries'][0]['id']
+    link = f"https://www.youtube.com/watch?v={video_code}"
+    search_cache.put(query, link)
 
-    return f"https://www.youtube.com/watch?v={video_code}"
+    return link
 
 
-async def preload(song: Song):
-    if song.info.title is not None:
+async def preload(song: Song, guild_id: int = 0):
+    if song.base_url is not None:
         return
 
-    def down(s: Song):
-        if s.host == linkutils.Sites.Spotify:
-            s.info.webpage_url = search_youtube(s.info.title)
-
-        if s.info.webpage_url is None:
-            return None
-        get_song_info(s)
-
-    if song.host == linkutils.Sites.Spotify:
+    if linkutils.identify_url(song.info.webpage_url) == linkutils.Sites.Spotify:
         song.info.title = await linkutils.convert_spotify(song.info.webpage_url)
+        if song.info.title is None:
+            return None
+        song.info.webpage_url = await search_youtube(song.info.title, guild_id)
 
-    loop = asyncio.get_event_loop()
-    executor = concurrent.futures.ThreadPoolExecutor(max_workers=config.MAX_SONG_PRELOAD)
-    await asyncio.wait(fs={loop.run_in_executor(executor, down, song)}, return_when=asyncio.ALL_COMPLETED)
+    if song.info.webpage_url is None:
+        return None
+    await get_song_info(song, guild_id)
 
 
 async def register_voice_channel(channel):
     await channel.connect(reconnect=True, timeout=None)
-
-
-class Timer:
-    def __init__(self, callback: Callable):
-        self._callback = callback
-        self._task = asyncio.create_task(self._job())
-
-    async def _job(self):
-        await asyncio.sleep(config.VC_TIMEOUT)
-        await self._callback()
-
-    def cancel(self):
-        self._task.cancel()
@@ -1,10 +1,13 @@
 import asyncio
-import os
 from datetime import (
     date,
     datetime,
 )
-from typing import NoReturn
+from typing import (
+    NoReturn,
+    Optional,
+    Set,
+)
 
 from bs4 import BeautifulSoup
 from discord import Embed
@@ -25,13 +28,16 @@ class MapleStory(CogBase):
     def __init__(self, bot: Bot) -> NoReturn:
         super().__init__(bot)
         self.crawler = MapleStoryEventCrawler()
-        db_url = os.environ.get("DATABASE_URL")
-        self.db = MapleStoryDatabaseHandler(db_url)
+        self.db = MapleStoryDatabaseHandler()
         self.channel = None
+        # bullentinIds already sent, so a page without new events doesn't query the database
+        self.seen_events: Optional[Set[int]] = None
 
     @commands.Cog.listener()
     async def on_ready(self):
         self.channel = self.bot.get_channel(907136601493217290)
+        if self.seen_events is None:
+            self.seen_events = await self.db.get_found_events()
         await self.get_newest_data_every10min()
 
     async def get_newest_data_every10min(self) -> NoReturn:
@@ -53,10 +59,19 @@ class MapleStory(CogBase):
                 return soup.prettify()
 
         # get data from page 1
-        for event_data in await self.crawler.get_event_list():
+        events = [
+            event_data for event_data in await self.crawler.get_event_list()
+            if is_today_news(event_data) and event_data['bullentinId'] not in self.seen_events
+        ]
+        if not events:
+            return
+        bullentin_ids = [event_data['bullentinId'] for event_data in events]
+        new_ids = await self.db.add_found_events(bullentin_ids)
+        self.seen_events.update(bullentin_ids)
+
+        for event_data in events:
             bullentin_id = event_data['bullentinId']
-            if is_today_news(event_data) and self.db.is_new_event(bullentin_id):
-                self.db.add_found_event(bullentin_id)
+            if bullentin_id in new_ids:
                 if event_data['urlLink'] is None:
                     detail_event_data = await self.crawler.get_event_data(bullentin_id)
                     embed = Embed(title=event_data['title'],
@@ -1,5 +1,4 @@
 import asyncio
-import os
 from asyncio import Task
 from datetime import (
     time,
@@ -32,14 +31,13 @@ class Leetcode(CogBase):
     def __init__(self, bot: Bot):
         super().__init__(bot)
         self.crawler = LeetCodeQuestionCrawler()
-        db_url = os.environ.get("DATABASE_URL")
-        self.db = LeetCodeDatabaseHandler(db_url)
+        self.db = LeetCodeDatabaseHandler()
         self.mention_channels: Dict[int, LeetCodeMentionChannel] = {}
         self.tasks: Dict[int, Task] = {}
 
     @commands.Cog.listener()
     async def on_ready(self):
-        self.mention_channels = {c.guild_id: c for c in self.db.get_mention_channels()}
+        self.mention_channels = {c.guild_id: c for c in await self.db.get_mention_channels()}
         for guild_id, mention_channel in self.mention_channels.items():
             task = self.bot.loop.create_task(
                 self.get_daily_question_everyday(mention_channel)
@@ -92,7 +90,7 @@ class Leetcode(CogBase):
         if task is not None:
             task.cancel()
 
-        self.db.update_notification(mention_channel)
+        await self.db.update_notification(mention_channel)
         self.mention_channels[ctx.guild.id] = mention_channel
         self.tasks[ctx.guild.id] = self.bot.loop.create_task(
             self.get_daily_question_everyday(mention_channel)
@@ -108,7 +106,7 @@ class Leetcode(CogBase):
         task.cancel()
         del self.tasks[ctx.guild.id]
         del self.mention_channels[ctx.guild.id]
-        self.db.remove_notification(ctx.guild.id)
+        await self.db.remove_notification(ctx.guild.id)
         await ctx.send("Mention removed")
 
     @commands.command(name='qrand', aliases=["刷題", "qr"])
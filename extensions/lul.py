@@ -1,5 +1,4 @@
 import datetime
-import os
 from collections import defaultdict
 
 from discord import Message
@@ -31,12 +30,14 @@ tag_reply_dict = {
 class HTS4(CogBase):
     def __init__(self, bot: Bot):
         super().__init__(bot)
-        db_url = os.environ.get("DATABASE_URL")
-        self.schedule_handler = ScheduleHandler(self.bot, db_url)
+        self.schedule_handler = ScheduleHandler(self.bot)
+
+    def cog_unload(self):
+        self.schedule_handler.close()
 
     @commands.Cog.listener()
     async def on_ready(self):
-        self.schedule_handler.load_schedule_from_database()
+        await self.schedule_handler.load_schedule_from_database()
 
     @commands.Cog.listener()
     async def on_message(self, msg: Message):
@@ -81,7 +82,7 @@ class HTS4(CogBase):
     @commands.command(aliases=["rr"])
     async def remove_remind(self, ctx: Context, remind_id: str):
         """移除提醒 remove_remind #remind_id aliases: rr"""
-        if self.schedule_handler.remove_schedule(remind_id):
+        if await self.schedule_handler.remove_schedule(remind_id):
             await ctx.send("已刪除該提醒")
         else:
             await ctx.send("無此提醒")
@@ -89,7 +90,7 @@ class HTS4(CogBase):
     @commands.command(aliases=["lr"])
     async def list_remind(self, ctx: Context):
         """列出所有提醒 aliases: lr"""
-        schedule_list = self.schedule_handler.list_schedule()
+        schedule_list = await self.schedule_handler.list_schedule()
         await ctx.send(schedule_list or "目前無提醒")
 
     @commands.command(name="欠債", aliases=["debt"])
@@ -17,6 +17,7 @@ from discord.ext.commands.errors import (
     NotOwner,
 )
 
+from cores import metrics
 from cores.classes import CogBase
 
 
@@ -120,6 +121,20 @@ class Main(CogBase):
         msg = "\n".join(i[11:] for i in self.bot.extensions.keys())
         await ctx.send(f"``{msg}``")
 
+    @commands.command(name='metrics')
+    @commands.is_owner()
+    async def _metrics(self, ctx: Context):
+        """列出效能統計"""
+        msg = metrics.export() or "no data"
+        await ctx.send(f"```{msg[:1990]}```")
+
+    @commands.command(name='dbstats')
+    @commands.is_owner()
+    async def _dbstats(self, ctx: Context):
+        """列出資料庫查詢統計"""
+        msg = metrics.export('db.') or "no data"
+        await ctx.send(f"```{msg[:1990]}```")
+
 
 def setup(bot: commands.Bot):
     bot.add_cog(Main(bot))
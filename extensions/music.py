@@ -1,9 +1,17 @@
 import asyncio
-import os
-from typing import Dict
+import sys
+import time
+from typing import (
+    Dict,
+    List,
+)
 
-import discord
-from discord import VoiceClient
+from discord import (
+    Guild,
+    Member,
+    VoiceClient,
+    VoiceState,
+)
 from discord.ext import commands
 from discord.ext.commands import (
     Bot,
@@ -11,15 +19,37 @@ from discord.ext.commands import (
 )
 
 from config import config
+from cores import metrics
 from cores.classes import CogBase
 from cores.musicbot import (
     linkutils,
     utils,
 )
 from cores.musicbot.audioController import AudioController
+from cores.musicbot.extractor import extractor
+from cores.musicbot.idleTimer import idle_timer
+from cores.musicbot.loudness import (
+    loudness_cache,
+    LoudnessDatabaseHandler,
+)
+from cores.musicbot.queueView import QueueView
+from cores.musicbot.sessions import (
+    MusicSessionDatabaseHandler,
+    session_store,
+)
 from cores.musicbot.settings import (
     MusicSettingsDatabaseHandler,
     Settings,
+    SettingsData,
+    settings_writer,
+)
+from cores.musicbot.spotify import (
+    spotify_importer,
+    SpotifyMatchDatabaseHandler,
+)
+from cores.musicbot.trackCache import (
+    track_cache,
+    TrackCacheDatabaseHandler,
 )
 
 
@@ -27,23 +57,112 @@ class Music(CogBase):
     def __init__(self, bot: Bot):
         super(Music, self).__init__(bot)
         self.guild_audio_controller: Dict[int, AudioController] = {}
-        db_url = os.environ.get("DATABASE_URL")
-        self.db = MusicSettingsDatabaseHandler(db_url)
+        self.guild_settings: Dict[int, SettingsData] = {}
+        # set once on_ready loaded the settings of all guilds, commands arriving earlier wait for it
+        self.settings_loaded = asyncio.Event()
+        self.db = MusicSettingsDatabaseHandler()
+        settings_writer.db = self.db
+        track_cache.db = TrackCacheDatabaseHandler()
+        spotify_importer.db = SpotifyMatchDatabaseHandler()
+        session_store.db = MusicSessionDatabaseHandler()
+        loudness_cache.db = LoudnessDatabaseHandler()
+        metrics.gauge('music.controllers', lambda: len(self.guild_audio_controller))
+
+    def cog_unload(self):
+        self.bot.loop.create_task(settings_writer.flush())
+        self.bot.loop.create_task(session_store.flush())
+        self.bot.loop.create_task(linkutils.close_session())
+
+    async def get_audio_controller(self, guild: Guild) -> AudioController:
+        """Returns the guild's controller, creating it and restoring its saved session on the first music command"""
+        audio_controller = self.guild_audio_controller.get(guild.id)
+        if audio_controller is not None:
+            return audio_controller
+
+        data = await self.get_settings_data(guild)
+        audio_controller = self.guild_audio_controller.get(guild.id)
+        if audio_controller is not None:
+            # created by a command that arrived meanwhile
+            return audio_controller
+
+        audio_controller = AudioController(guild, Settings(guild, data))
+        self.guild_audio_controller[guild.id] = audio_controller
+
+        restored = False
+        try:
+            data = await session_store.load(guild.id)
+            if data is not None:
+                audio_controller.restore(data)
+                restored = True
+        except Exception as e:
+            print(f"Could not restore the session of {guild.id}: {e}")
+        # only watched after restoring, so an empty controller never overwrites the saved session
+        session_store.watch(audio_controller, restored)
+        return audio_controller
+
+    async def get_settings_data(self, guild: Guild) -> SettingsData:
+        """Returns the guild's settings, waiting for the initial load and inserting defaults for a new guild"""
+        await self.settings_loaded.wait()
+        data = self.guild_settings.get(guild.id)
+        if data is not None:
+            return data
+
+        # joined after startup, or the initial load failed
+        data = await self.db.get_settings(guild.id)
+        if data is None:
+            data = Settings(guild).config
+            await self.db.insert_default_settings([data])
+        return self.guild_settings.setdefault(guild.id, data)
+
+    @commands.Cog.listener()
+    async def on_voice_state_update(self, member: Member, before: VoiceState, after: VoiceState):
+        voice_client = member.guild.voice_client
+        if voice_client is None:
+            idle_timer.set_channel_empty(member.guild.id, False)
+            return
+        channel = voice_client.channel
+        if channel not in (before.channel, after.channel) and member != self.bot.user:
+            return
+        idle_timer.set_channel_empty(member.guild.id, not any(not m.bot for m in channel.members))
 
     @commands.Cog.listener()
     async def on_ready(self):
-        for g in self.bot.guilds:
-            g_settings = self.db.get_settings(g.id)
-            s = Settings(g, g_settings)
-            if g_settings is None:
-                self.db.save_settings(s.config)
-            self.guild_audio_controller[g.id] = AudioController(g, s)
+        # on_ready runs again after every reconnect, the controllers keep the settings loaded the first time
+        if self.settings_loaded.is_set():
+            return
+        started = time.perf_counter()
+        self.bot.loop.create_task(extractor.warm())
+
+        # controllers are created on a guild's first music command, only the settings are loaded here
+        missing: List[SettingsData] = []
+        try:
+            self.guild_settings.update(await self.db.get_all_settings())
+            for g in self.bot.guilds:
+                if g.id not in self.guild_settings:
+                    data = Settings(g).config
+                    self.guild_settings[g.id] = data
+                    missing.append(data)
+            if missing:
+                await self.db.insert_default_settings(missing)
+        finally:
+            self.settings_loaded.set()
+
+        elapsed = time.perf_counter() - started
+        metrics.histogram('music.ready').observe(elapsed)
+        settings_bytes = sum(
+            sys.getsizeof(data) + sum(sys.getsizeof(value) for value in data.values())
+            for data in self.guild_settings.values()
+        )
+        print(
+            f"Music ready in {elapsed:.3f}s for {len(self.bot.guilds)} guilds ({len(missing)} new), "
+            f"{settings_bytes // max(len(self.guild_settings), 1)} bytes of settings per guild"
+        )
 
     @commands.command(name='play', description=config.HELP_YT_LONG, help=config.HELP_YT_SHORT,
                       aliases=['p', 'yt', 'pl'])
     async def _play_song(self, ctx: Context, *, track: str):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
 
         if await audio_controller.is_connected() is None:
             if not await audio_controller.connect(ctx):
@@ -54,8 +173,7 @@ class Music(CogBase):
             return
 
         # reset timer
-        audio_controller.timer.cancel()
-        audio_controller.timer = utils.Timer(audio_controller.timeout_handler)
+        idle_timer.touch(current_guild.id)
 
         if audio_controller.playlist.loop:
             await ctx.send(f"Loop is enabled! Use {config.BOT_PREFIX}loop to disable")
@@ -77,7 +195,7 @@ class Music(CogBase):
     @commands.command(name='loop', description=config.HELP_LOOP_LONG, help=config.HELP_LOOP_SHORT, aliases=['l'])
     async def _loop(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
 
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
@@ -101,8 +219,7 @@ class Music(CogBase):
                       aliases=["sh"])
     async def _shuffle(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        guild_id = current_guild.id
-        audio_controller = self.guild_audio_controller[guild_id]
+        audio_controller = await self.get_audio_controller(current_guild)
 
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
@@ -116,14 +233,12 @@ class Music(CogBase):
 
         audio_controller.playlist.shuffle()
         await ctx.send("Shuffled queue :twisted_rightwards_arrows:")
-
-        for song in list(audio_controller.playlist.play_deque)[:config.MAX_SONG_PRELOAD]:
-            asyncio.ensure_future(utils.preload(song))
+        audio_controller.preload_queue()
 
     @commands.command(name='pause', description=config.HELP_PAUSE_LONG, help=config.HELP_PAUSE_SHORT)
     async def _pause(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -136,9 +251,9 @@ class Music(CogBase):
 
     @commands.command(name='queue', description=config.HELP_QUEUE_LONG, help=config.HELP_QUEUE_SHORT,
                       aliases=['playlist', 'q'])
-    async def _queue(self, ctx: Context):
+    async def _queue(self, ctx: Context, page: int = 1):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -149,26 +264,13 @@ class Music(CogBase):
             await ctx.send("Queue is empty :x:")
             return
 
-        playlist = audio_controller.playlist
-
-        # Embeds are limited to 25 fields
-        if config.MAX_SONG_PRELOAD > 25:
-            config.MAX_SONG_PRELOAD = 25
-
-        embed = discord.Embed(title=f":scroll: Queue [{len(playlist.play_deque)}]", color=config.EMBED_COLOR)
-
-        for counter, song in enumerate(list(playlist.play_deque)[:config.MAX_SONG_PRELOAD], start=1):
-            if song.info.title is None:
-                embed.add_field(name=f"{counter}.", value=f"[{song.info.webpage_url}]({song.info.webpage_url})", inline=False)
-            else:
-                embed.add_field(name=f"{counter}.", value=f"[{song.info.title}]({song.info.webpage_url})", inline=False)
-
-        await ctx.send(embed=embed)
+        view = QueueView(audio_controller.queue_pages, page - 1)
+        await ctx.send(embed=audio_controller.queue_pages.render(view.page), view=view)
 
     @commands.command(name='stop', description=config.HELP_STOP_LONG, help=config.HELP_STOP_SHORT, aliases=['st'])
     async def _stop(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -179,8 +281,7 @@ class Music(CogBase):
     @commands.command(name='move', description=config.HELP_MOVE_LONG, help=config.HELP_MOVE_SHORT, aliases=['mv'])
     async def _move(self, ctx: Context, old_index: int, new_index: int):
         current_guild = utils.get_guild(ctx)
-        guild_id = current_guild.id
-        audio_controller = self.guild_audio_controller[guild_id]
+        audio_controller = await self.get_audio_controller(current_guild)
         voice_client = current_guild.voice_client
         if not isinstance(voice_client, VoiceClient):
             raise Exception("Should be VoiceClient")
@@ -192,18 +293,18 @@ class Music(CogBase):
         except IndexError:
             await ctx.send("Wrong position")
             return
+        audio_controller.preload_queue()
         await ctx.send("Moved")
 
     @commands.command(name='skip', description=config.HELP_SKIP_LONG, help=config.HELP_SKIP_SHORT, aliases=['s'])
     async def _skip(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
         audio_controller.playlist.loop = False
-        audio_controller.timer.cancel()
-        audio_controller.timer = utils.Timer(audio_controller.timeout_handler)
+        idle_timer.touch(current_guild.id)
 
         voice_client = current_guild.voice_client
         if not isinstance(voice_client, VoiceClient):
@@ -218,8 +319,7 @@ class Music(CogBase):
     @commands.command(name='clear', description=config.HELP_CLEAR_LONG, help=config.HELP_CLEAR_SHORT, aliases=['cl'])
     async def _clear(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        guild_id = current_guild.id
-        audio_controller = self.guild_audio_controller[guild_id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -234,13 +334,12 @@ class Music(CogBase):
     @commands.command(name='prev', description=config.HELP_PREV_LONG, help=config.HELP_PREV_SHORT, aliases=['back'])
     async def _prev(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
         audio_controller.playlist.loop = False
-        audio_controller.timer.cancel()
-        audio_controller.timer = utils.Timer(audio_controller.timeout_handler)
+        idle_timer.touch(current_guild.id)
 
         await audio_controller.prev_song(ctx)
         await ctx.send("Playing previous song :track_previous:")
@@ -248,7 +347,7 @@ class Music(CogBase):
     @commands.command(name='resume', description=config.HELP_RESUME_LONG, help=config.HELP_RESUME_SHORT)
     async def _resume(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -262,7 +361,7 @@ class Music(CogBase):
                       aliases=["np"])
     async def _song_info(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        audio_controller = self.guild_audio_controller[current_guild.id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
@@ -274,18 +373,16 @@ class Music(CogBase):
     @commands.command(name='history', description=config.HELP_HISTORY_LONG, help=config.HELP_HISTORY_SHORT)
     async def _history(self, ctx: Context):
         current_guild = utils.get_guild(ctx)
-        guild_id = current_guild.id
-        audio_controller = self.guild_audio_controller[guild_id]
+        audio_controller = await self.get_audio_controller(current_guild)
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
 
-        await ctx.send(self.guild_audio_controller[guild_id].track_history())
+        await ctx.send(audio_controller.track_history())
 
     @commands.command(name='volume', aliases=["vol"], description=config.HELP_VOL_LONG, help=config.HELP_VOL_SHORT)
     async def _volume(self, ctx: Context, *args):
         current_guild = utils.get_guild(ctx)
-        guild_id = current_guild.id
-        audio_controller = self.guild_audio_controller[guild_id]
+        audio_controller = await self.get_audio_controller(current_guild)
 
         if not await utils.playable(ctx, current_guild, audio_controller.sett):
             return
@@ -299,11 +396,11 @@ class Music(CogBase):
             volume = int(volume)
             if volume > 100 or volume < 0:
                 raise ValueError
-            if self.guild_audio_controller[guild_id].volume >= volume:
+            if audio_controller.volume >= volume:
                 await ctx.send(f'Volume set to {volume}% :sound:')
             else:
                 await ctx.send(f'Volume set to {volume}% :loud_sound:')
-            self.guild_audio_controller[guild_id].volume = volume
+            audio_controller.volume = volume
         except ValueError:
             await ctx.send("Error: Volume must be a number 1-100")
 
@@ -3,9 +3,20 @@ import os
 from discord.ext import commands
 
 from config import config
+from cores.database import database
+
+
+class Bot(commands.Bot):
+    async def close(self):
+        # pending writes are flushed before the pool closes
+        await database.close()
+        await super(Bot, self).close()
+
 
 print("機器人登入中 ...")
-bot = commands.Bot(command_prefix=config.BOT_PREFIX)
+bot = Bot(command_prefix=config.BOT_PREFIX)
+bot.loop.run_until_complete(database.connect(os.environ.get("DATABASE_URL")))
+bot.loop.run_until_complete(database.migrate())
 
 for extension in os.listdir('extensions'):
     if extension.endswith('.py'):
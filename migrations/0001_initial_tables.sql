@@ -0,0 +1,64 @@
+-- The tables as the handlers used to create them on their first start,
+-- so existing databases are taken over unchanged.
+
+CREATE TABLE IF NOT EXISTS schedules (
+    id uuid PRIMARY KEY,
+    channel_id bigint not null,
+    target_time time not null,
+    msg varchar not null,
+    repeat bool not null
+);
+
+CREATE TABLE IF NOT EXISTS maple_story_event (
+    id serial PRIMARY KEY,
+    bullentinId int not null
+);
+
+CREATE TABLE IF NOT EXISTS leetcode (
+    guild_id bigint PRIMARY KEY,
+    target_time time not null,
+    message_channel bigint not null,
+    thread_channel bigint
+);
+
+CREATE TABLE IF NOT EXISTS music_settings (
+    guild_id bigint PRIMARY KEY,
+    default_nickname char(32) not null,
+    command_channel int null,
+    start_voice_channel int null,
+    user_must_be_in_vc bool not null,
+    button_emote char(32) not null,
+    default_volume smallint not null,
+    vc_timeout bool not null
+);
+
+CREATE TABLE IF NOT EXISTS music_sessions (
+    guild_id bigint PRIMARY KEY,
+    queue bytea not null,
+    current bytea null,
+    position int not null,
+    loop bool not null,
+    volume smallint not null,
+    updated_at timestamptz not null default now()
+);
+
+CREATE TABLE IF NOT EXISTS track_cache (
+    track_key varchar PRIMARY KEY,
+    title varchar null,
+    uploader varchar null,
+    duration int null,
+    webpage_url varchar not null,
+    thumbnail varchar null,
+    stream_url varchar null,
+    stream_expire bigint null
+);
+
+CREATE TABLE IF NOT EXISTS track_loudness (
+    track_key varchar PRIMARY KEY,
+    loudness real not null
+);
+
+CREATE TABLE IF NOT EXISTS spotify_match (
+    match_key varchar PRIMARY KEY,
+    video_id varchar(16) not null
+);
@@ -0,0 +1,14 @@
+-- Each event is sent once, the lookups by bullentinId use the unique index.
+DELETE FROM maple_story_event a
+USING maple_story_event b
+WHERE a.bullentinId = b.bullentinId AND a.id > b.id;
+
+ALTER TABLE maple_story_event
+    ADD CONSTRAINT maple_story_event_bullentinid_key UNIQUE (bullentinId);
+
+-- Discord snowflakes don't fit into int, char(32) padded the values with spaces.
+ALTER TABLE music_settings
+    ALTER COLUMN command_channel TYPE bigint,
+    ALTER COLUMN start_voice_channel TYPE bigint,
+    ALTER COLUMN default_nickname TYPE varchar(32) USING rtrim(default_nickname),
+    ALTER COLUMN button_emote TYPE varchar(32) USING rtrim(button_emote);
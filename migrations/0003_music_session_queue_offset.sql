@@ -0,0 +1,3 @@
+-- Songs dropped from the head of the saved queue since it was last written in full.
+ALTER TABLE music_sessions
+    ADD COLUMN queue_offset int not null default 0;
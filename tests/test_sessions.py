@@ -0,0 +1,72 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from cores.musicbot.indexedQueue import IndexedQueue
+from cores.musicbot.sessions import (
+    SessionData,
+    SessionStore,
+)
+
+GUILD_ID = 1
+
+
+class FakeController(object):
+    def __init__(self, songs):
+        self.guild = SimpleNamespace(id=GUILD_ID)
+        self.playlist = SimpleNamespace(play_deque=IndexedQueue(songs))
+
+    def session_state(self):
+        return None, 0, False, 100
+
+    def snapshot(self) -> SessionData:
+        return SessionData(
+            guild_id=GUILD_ID, queue=repr(list(self.playlist.play_deque)).encode(), queue_offset=0,
+            current=None, position=0, loop=False, volume=100
+        )
+
+
+class FlakyDatabase(object):
+    """Records the writes, the first `failures` of them raise"""
+
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.writes = []
+
+    async def save_sessions(self, snapshots, states):
+        if self.failures:
+            self.failures -= 1
+            raise ConnectionError("connection lost")
+        self.writes.append((snapshots, states))
+
+
+def test_failed_write_is_followed_by_full_snapshot():
+    async def run():
+        store = SessionStore(interval=3600)
+        store.db = FlakyDatabase(failures=1)
+        controller = FakeController(['a', 'b', 'c', 'd'])
+        store.watch(controller)
+        store._task.cancel()
+
+        # the queue changed, the snapshot write fails
+        controller.playlist.play_deque.append('e')
+        with pytest.raises(ConnectionError):
+            await store.flush()
+
+        # only the head was dropped since, an offset alone would apply to the queue saved before
+        controller.playlist.play_deque.popleft()
+        await store.flush()
+
+        assert len(store.db.writes) == 1
+        snapshots, states = store.db.writes[0]
+        assert [s['guild_id'] for s in snapshots] == [GUILD_ID]
+        assert snapshots[0]['queue'] == repr(['b', 'c', 'd', 'e']).encode()
+        assert states == []
+
+        # once saved, dropping the head is an offset update again
+        controller.playlist.play_deque.popleft()
+        await store.flush()
+        assert store.db.writes[1] == ([], [(GUILD_ID, None, 0, False, 100, 1)])
+
+    asyncio.run(run())